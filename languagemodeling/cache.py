@@ -0,0 +1,58 @@
+# https://docs.python.org/3/library/collections.html
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """Mapping with a bounded number of items, that drops the least recently
+    used ones when full. Counts the hits and misses of get.
+    """
+
+    def __init__(self, maxsize):
+        """
+        maxsize -- maximum number of items (> 0).
+        """
+        assert maxsize > 0
+        self._items = OrderedDict()
+        self._maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        """Value of a key, marking it as recently used (default if missing).
+
+        key -- the key.
+        default -- value to return if the key is missing.
+        """
+        try:
+            value = self._items[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self._items.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def __setitem__(self, key, value):
+        self._items[key] = value
+        self._items.move_to_end(key)
+        if len(self._items) > self._maxsize:
+            self._items.popitem(last=False)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def __len__(self):
+        return len(self._items)
+
+    def clear(self):
+        """Remove all the items (the counters are kept)."""
+        self._items.clear()
+
+    def info(self):
+        """Dict with the hits, misses, current size and maximum size."""
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._items),
+            'maxsize': self._maxsize,
+        }
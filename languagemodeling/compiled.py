@@ -0,0 +1,487 @@
+"""Language models compiled to backoff tables, and ARPA files.
+
+A CompiledNGram stores, for every order k, the k-grams of the model with the
+final log-probability of their last token given the others and, if k < n, the
+backoff weight of the k-gram as a context. The log-probability of a token
+after a context h is that of the longest k-gram h[i:] + (token,) in the
+tables, plus the backoff weights of the longer contexts h[j:], j < i.
+
+BackOffNGram, InterpolatedNGram and KneserNeyNGram have this form exactly:
+
+  - back-off: the weight of a context h is alpha(h) / denom(h).
+  - interpolation: the weight of a context h is gamma / (c(h) + gamma), as
+    P(w | h) = lambda(h) c(h w) / c(h) + (1 - lambda(h)) P(w | h[1:]) with
+    lambda(h) = c(h) / (c(h) + gamma).
+  - Kneser-Ney: the weight of a context h is the mass it gives to the lower
+    order divided by the total count of its successors (1 if it has none).
+
+Log-probabilities are in base 10, as in ARPA files.
+"""
+import math
+
+import numpy as np
+
+from languagemodeling.consts import START_TOKEN, END_TOKEN
+from languagemodeling.counts import Vocabulary, UNK_ID, pack_keys, \
+    unpack_keys, find_keys
+from languagemodeling.ngram import BaseNGram, InterpolatedNGram, \
+    BackOffNGram, KneserNeyNGram
+
+
+UNK_TOKEN = '<unk>'
+# log-probability written for impossible events in ARPA files
+ARPA_LOG_ZERO = -99
+# dtype of the codes of quantized models, by number of bits
+QUANTIZE_BITS = {8: np.uint8, 16: np.uint16}
+
+
+class CompiledNGram(BaseNGram):
+
+    def __init__(self, n, vocab, keys, log_probs, backoffs, unk_log_prob):
+        """
+        n -- order of the model.
+        vocab -- the Vocabulary.
+        keys -- dict from order k to the sorted packed keys of the k-grams.
+        log_probs -- dict from order k to the log-probabilities of the
+            k-grams, aligned with keys.
+        backoffs -- dict from order k < n to the log backoff weights of the
+            k-grams, aligned with keys.
+        unk_log_prob -- log-probability of unknown tokens.
+        """
+        self._n = n
+        self._vocab = vocab
+        self._keys = keys
+        self._log_probs = log_probs
+        self._backoffs = backoffs
+        self._unk_log_prob = unk_log_prob
+
+    def vocab(self):
+        return self._vocab
+
+    def cond_prob(self, token, prev_tokens=None):
+        """Conditional probability of a token.
+
+        token -- the token.
+        prev_tokens -- the previous tokens (at most n - 1 are used).
+        """
+        prev_tokens = tuple(prev_tokens or ())
+        prev_tokens = prev_tokens[-self._n + 1:] if self._n > 1 else ()
+        ids = self._vocab.ids(prev_tokens + (token,))
+        log_prob = self._cond_log_probs(np.array([ids], dtype=np.uint32))[0]
+        return 10 ** log_prob
+
+    def _cond_probs(self, ngrams):
+        return 10 ** self._cond_log_probs(ngrams)
+
+    def _cond_log_probs(self, ngrams):
+        # log10 of the probability of the last token of each row given the
+        # others, backing off from the longest k-gram
+        m, width = ngrams.shape
+        log_probs = np.zeros(m)
+        done = np.zeros(m, dtype=bool)
+        for k in range(width, 0, -1):
+            rows = find_keys(self._keys[k], ngrams[:, width - k:])
+            hit = ~done & (rows >= 0)
+            log_probs[hit] += self.log_probs(k, rows[hit])
+            done |= hit
+            if k > 1:
+                rows = find_keys(self._keys[k - 1], ngrams[:, width - k:-1])
+                back = ~done & (rows >= 0)
+                log_probs[back] += self.backoffs(k - 1, rows[back])
+        log_probs[~done] += self._unk_log_prob
+        return log_probs
+
+    def log_probs(self, k, rows=slice(None)):
+        """Log-probabilities of some k-grams, given their rows in the tables.
+
+        k -- the order.
+        rows -- the rows (default: all of them).
+        """
+        return self._log_probs[k][rows]
+
+    def backoffs(self, k, rows=slice(None)):
+        """Log backoff weights of some k-grams, given their rows in the
+        tables.
+
+        k -- the order (k < n).
+        rows -- the rows (default: all of them).
+        """
+        return self._backoffs[k][rows]
+
+    def num_ngrams(self):
+        """Dict from order k to the number of k-grams in the tables."""
+        return {k: len(keys) for k, keys in self._keys.items()}
+
+    def nbytes(self):
+        """Bytes used by the tables (the vocabulary excluded)."""
+        arrays = [self._keys, self._log_probs, self._backoffs]
+        return sum(a.nbytes for d in arrays for a in d.values())
+
+
+class QuantizedNGram(CompiledNGram):
+    """CompiledNGram storing each log-probability and backoff weight as the
+    index of its value in a small per-order codebook.
+    """
+
+    def __init__(self, n, vocab, keys, log_probs, backoffs, unk_log_prob,
+                 prob_codebooks, backoff_codebooks):
+        """
+        n -- order of the model.
+        vocab -- the Vocabulary.
+        keys -- dict from order k to the sorted packed keys of the k-grams.
+        log_probs -- dict from order k to the codes of the log-probabilities
+            of the k-grams, aligned with keys.
+        backoffs -- dict from order k < n to the codes of the log backoff
+            weights of the k-grams, aligned with keys.
+        unk_log_prob -- log-probability of unknown tokens.
+        prob_codebooks -- dict from order k to the log-probability of each
+            code.
+        backoff_codebooks -- dict from order k < n to the log backoff weight
+            of each code.
+        """
+        super().__init__(n, vocab, keys, log_probs, backoffs, unk_log_prob)
+        self._prob_codebooks = prob_codebooks
+        self._backoff_codebooks = backoff_codebooks
+
+    def log_probs(self, k, rows=slice(None)):
+        return self._prob_codebooks[k][self._log_probs[k][rows]]
+
+    def backoffs(self, k, rows=slice(None)):
+        return self._backoff_codebooks[k][self._backoffs[k][rows]]
+
+    def nbytes(self):
+        codebooks = [self._prob_codebooks, self._backoff_codebooks]
+        return super().nbytes() + \
+            sum(a.nbytes for d in codebooks for a in d.values())
+
+
+def compile_model(model):
+    """Compile a BackOffNGram, an InterpolatedNGram or a KneserNeyNGram to a
+    CompiledNGram.
+
+    model -- the model.
+    """
+    if not isinstance(model, (BackOffNGram, InterpolatedNGram, KneserNeyNGram)):
+        raise TypeError('can not compile a {}'.format(type(model).__name__))
+
+    n = model._n
+    counts = model._count
+    vocab = counts.vocab()
+    start_id = vocab.id(START_TOKEN)
+    num_tokens = counts[()]
+
+    keys = {}
+    log_probs = {}
+    backoffs = {}
+    probs = {}
+    with np.errstate(divide='ignore'):
+        for k in range(1, n + 1):
+            ids, c = counts.table(k)
+            keys[k] = counts._keys[k].copy()
+            if isinstance(model, KneserNeyNGram):
+                # the lower order distributions of width k
+                probs[k] = model._cond_probs(ids)
+            elif k == 1:
+                if model._addone:
+                    probs[k] = (c + 1) / (num_tokens + model._V)
+                else:
+                    probs[k] = c / num_tokens
+            else:
+                c_prev = counts.lookup(k - 1, ids[:, :-1])
+                if isinstance(model, BackOffNGram):
+                    probs[k] = (c - model._beta) / c_prev
+                else:
+                    lower = probs[k - 1][counts.find(k - 1, ids[:, 1:])]
+                    lambdas = c_prev / (c_prev + model._gamma)
+                    probs[k] = lambdas * c / c_prev + (1 - lambdas) * lower
+            # START_TOKEN is never predicted, its k-grams are only contexts
+            log_probs[k] = np.where(ids[:, -1] == start_id, -math.inf,
+                                    np.log10(probs[k]))
+
+            if k < n:
+                if isinstance(model, KneserNeyNGram):
+                    total = model._totals[k]
+                    weights = np.divide(model._backoff_mass[k], total,
+                                        out=np.ones(len(total)), where=total > 0)
+                elif isinstance(model, BackOffNGram):
+                    alpha = model._alpha[k]
+                    weights = np.divide(alpha, model._denoms[k],
+                                        out=np.zeros(len(alpha)),
+                                        where=alpha != 0)
+                else:
+                    weights = model._gamma / (c + model._gamma)
+                backoffs[k] = np.log10(weights)
+
+    if isinstance(model, KneserNeyNGram):
+        unk_log_prob = math.log10(
+            model._backoff_mass[0][0] / model._totals[0][0] / model._V)
+    elif model._addone:
+        unk_log_prob = math.log10(1 / (num_tokens + model._V))
+    else:
+        unk_log_prob = -math.inf
+
+    return CompiledNGram(n, vocab, keys, log_probs, backoffs, unk_log_prob)
+
+
+def quantize_model(model, bits=8):
+    """Quantize the log-probabilities and backoff weights of a CompiledNGram
+    to codes of 8 or 16 bits, with a codebook for each order and kind of
+    value.
+
+    model -- the compiled model.
+    bits -- bits per code, 8 or 16.
+    """
+    if bits not in QUANTIZE_BITS:
+        raise ValueError('can not quantize to {} bits'.format(bits))
+
+    log_probs = {}
+    prob_codebooks = {}
+    backoffs = {}
+    backoff_codebooks = {}
+    for k in range(1, model._n + 1):
+        prob_codebooks[k], log_probs[k] = _train_codebook(model.log_probs(k), bits)
+        if k < model._n:
+            backoff_codebooks[k], backoffs[k] = \
+                _train_codebook(model.backoffs(k), bits)
+
+    return QuantizedNGram(model._n, model._vocab, model._keys, log_probs,
+                          backoffs, model._unk_log_prob, prob_codebooks,
+                          backoff_codebooks)
+
+
+def _train_codebook(values, bits):
+    # Codebook of 2 ** bits values and the code of each value. The finite
+    # values are sorted and split into bins of the same size, each one
+    # represented by its mean, and coded to the nearest one. If there are
+    # fewer distinct values than codes they are kept exactly. -inf has its
+    # own code.
+    dtype = QUANTIZE_BITS[bits]
+    finite = np.isfinite(values)
+    num_codes = 2 ** bits - (not finite.all())
+
+    unique = np.unique(values[finite])
+    if len(unique) <= num_codes:
+        centers = unique
+    else:
+        finite_values = np.sort(values[finite])
+        edges = np.linspace(0, len(finite_values), num_codes + 1).astype(np.int64)
+        sums = np.add.reduceat(finite_values, edges[:-1])
+        centers = np.unique(sums / np.diff(edges))
+
+    codes = np.zeros(len(values), dtype=dtype)
+    if len(centers):
+        bounds = (centers[1:] + centers[:-1]) / 2
+        codes[finite] = np.searchsorted(bounds, values[finite])
+    codebook = centers
+    if not finite.all():
+        codes[~finite] = len(centers)
+        codebook = np.append(centers, -math.inf)
+    return codebook, codes
+
+
+def prune_model(model, threshold=None, size=None):
+    """Relative entropy pruning of a CompiledNGram (Stolcke, 1998).
+
+    The k-grams with k > 1 whose removal increases the perplexity of the
+    model the least are removed, and the backoff weights are recomputed so
+    that the distributions sum to 1. The increase for each k-gram is
+    estimated independently of the others, from the model before pruning.
+    k-grams that are contexts of kept (k + 1)-grams are always kept.
+
+    model -- the compiled model.
+    threshold -- the maximum relative increase in perplexity for removing
+        a k-gram.
+    size -- the number of k-grams with k > 1 to keep instead (approximate,
+        as the contexts of kept k-grams are kept too).
+    """
+    assert (threshold is None) != (size is None)
+    n = model._n
+    ids = {k: unpack_keys(model._keys[k], k) for k in range(1, n + 1)}
+    increases = {k: _pruning_increases(model, ids[k]) for k in range(2, n + 1)}
+
+    if size is not None:
+        all_increases = np.sort(np.concatenate(
+            [np.empty(0)] + list(increases.values())))
+        num_pruned = len(all_increases) - size
+        if num_pruned <= 0:
+            threshold = -math.inf
+        elif num_pruned >= len(all_increases):
+            threshold = math.inf
+        else:
+            threshold = all_increases[num_pruned]
+
+    keep = {1: np.ones(len(ids[1]), dtype=bool)}
+    for k in range(n, 1, -1):
+        keep[k] = increases[k] >= threshold
+        if k < n:
+            keep[k][find_keys(model._keys[k], ids[k + 1][keep[k + 1]][:, :-1])] = True
+
+    keys = {k: model._keys[k][keep[k]] for k in keep}
+    log_probs = {k: model.log_probs(k)[keep[k]] for k in keep}
+    backoffs = {k: model.backoffs(k)[keep[k]] for k in range(1, n)}
+    pruned = CompiledNGram(n, model._vocab, keys, log_probs, backoffs,
+                           model._unk_log_prob)
+
+    # from the lowest order up, as the weights of a context depend on the
+    # probabilities of the lower orders
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for k in range(1, n):
+            ngrams = unpack_keys(keys[k + 1], k + 1)
+            num, den = _context_masses(pruned, k, ngrams)
+            weights = np.log10(num) - np.log10(den)
+            valid = (num > 0) & (den > 0)
+            backoffs[k] = np.where(valid, weights, backoffs[k])
+    return pruned
+
+
+def _context_masses(model, k, ngrams):
+    # For every k-gram h, the probability mass left by the (k + 1)-grams of
+    # the model for the tokens after h, and the mass of the same tokens
+    # after h[1:]. The backoff weight of h is their ratio.
+    contexts = find_keys(model._keys[k], ngrams[:, :-1])
+    probs = 10 ** model.log_probs(k + 1)
+    lower_probs = 10 ** model._cond_log_probs(ngrams[:, 1:])
+    size = len(model._keys[k])
+    num = 1 - np.bincount(contexts, weights=probs, minlength=size)
+    den = 1 - np.bincount(contexts, weights=lower_probs, minlength=size)
+    return num, den
+
+
+def _pruning_increases(model, ngrams):
+    # relative increase in perplexity for removing each of some k-grams
+    k = ngrams.shape[1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        num, den = _context_masses(model, k - 1, ngrams)
+        contexts = find_keys(model._keys[k - 1], ngrams[:, :-1])
+        num = num[contexts]
+        den = den[contexts]
+        log_prob = model.log_probs(k)
+        prob = 10 ** log_prob
+        lower_log_prob = model._cond_log_probs(ngrams[:, 1:])
+        backoff = model.backoffs(k - 1, contexts)
+        # backoff weight of the context without the k-gram
+        new_backoff = np.log10(num + prob) - np.log10(den + 10 ** lower_log_prob)
+
+        # change in entropy (log10) of the distribution after the context,
+        # weighted by the probability of the context
+        delta = -10 ** _history_log_probs(model, ngrams[:, :-1]) * (
+            prob * (lower_log_prob + new_backoff - log_prob) +
+            num * (new_backoff - backoff))
+        delta = np.where(prob > 0, delta, 0)
+    return np.nan_to_num(10 ** delta - 1, nan=math.inf)
+
+
+def _history_log_probs(model, contexts):
+    # log-probability of each context by the chain rule. A context starting
+    # with START_TOKENs is a sentence start, with the probability of the end
+    # of a sentence.
+    start_id = model._vocab.id(START_TOKEN)
+    end_id = model._vocab.id(END_TOKEN)
+    start = contexts == start_id
+    log_probs = np.where(start[:, 0],
+                         model._cond_log_probs(np.array([[end_id]]))[0], 0)
+    for j in range(contexts.shape[1]):
+        log_probs += np.where(start[:, j], 0,
+                              model._cond_log_probs(contexts[:, :j + 1]))
+    return log_probs
+
+
+def save_arpa(model, filename):
+    """Write a CompiledNGram as an ARPA text file.
+
+    model -- the compiled model.
+    filename -- name of the output file.
+    """
+    tokens = model._vocab.tokens()
+    n = model._n
+    add_unk = model._unk_log_prob > -math.inf and UNK_TOKEN not in model._vocab
+
+    with open(filename, 'w') as f:
+        f.write('\n\\data\\\n')
+        for k in range(1, n + 1):
+            size = len(model._keys[k]) + (add_unk and k == 1)
+            f.write('ngram {}={}\n'.format(k, size))
+
+        for k in range(1, n + 1):
+            f.write('\n\\{}-grams:\n'.format(k))
+            if add_unk and k == 1:
+                f.write('{}\t{}\n'.format(_arpa_float(model._unk_log_prob),
+                                          UNK_TOKEN))
+            ids = unpack_keys(model._keys[k], k).tolist()
+            log_probs = model.log_probs(k).tolist()
+            backoffs = model.backoffs(k).tolist() if k < n else None
+            for i, row in enumerate(ids):
+                line = '{}\t{}'.format(_arpa_float(log_probs[i]),
+                                       ' '.join(tokens[j] for j in row))
+                if backoffs is not None:
+                    line += '\t{}'.format(_arpa_float(backoffs[i]))
+                f.write(line + '\n')
+
+        f.write('\n\\end\\\n')
+
+
+def load_arpa(filename):
+    """Read an ARPA text file as a CompiledNGram.
+
+    filename -- name of the ARPA file.
+    """
+    vocab = Vocabulary()
+    sizes = {}
+    entries = {}
+    k = None
+    with open(filename, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if line == '\\data\\':
+                continue
+            if line == '\\end\\':
+                break
+            if line.startswith('ngram '):
+                order, size = line[len('ngram '):].split('=')
+                sizes[int(order)] = int(size)
+            elif line.startswith('\\') and line.endswith('-grams:'):
+                k = int(line[1:-len('-grams:')])
+                entries[k] = ([], [], [])
+            else:
+                fields = line.split()
+                ngram = fields[1:k + 1]
+                entries[k][0].append(vocab.add_all(ngram))
+                entries[k][1].append(_parse_arpa_float(fields[0]))
+                entries[k][2].append(_parse_arpa_float(fields[k + 1])
+                                     if len(fields) > k + 1 else 0.0)
+
+    n = max(sizes)
+    keys = {}
+    log_probs = {}
+    backoffs = {}
+    for k in range(1, n + 1):
+        ids, k_log_probs, k_backoffs = entries.get(k, ([], [], []))
+        if len(ids) != sizes.get(k, 0):
+            raise ValueError('expected {} {}-grams in {}, found {}'.format(
+                sizes.get(k, 0), k, filename, len(ids)))
+        packed = pack_keys(np.array(ids, dtype=np.uint32).reshape(-1, k))
+        order = np.argsort(packed, kind='stable')
+        keys[k] = packed[order]
+        log_probs[k] = np.array(k_log_probs, dtype=np.float64)[order]
+        if k < n:
+            backoffs[k] = np.array(k_backoffs, dtype=np.float64)[order]
+
+    unk_log_prob = -math.inf
+    unk_id = vocab.id(UNK_TOKEN)
+    if unk_id != UNK_ID:
+        row = find_keys(keys[1], np.array([[unk_id]]))[0]
+        if row >= 0:
+            unk_log_prob = float(log_probs[1][row])
+
+    return CompiledNGram(n, vocab, keys, log_probs, backoffs, unk_log_prob)
+
+
+def _arpa_float(x):
+    return repr(x) if x > ARPA_LOG_ZERO else str(ARPA_LOG_ZERO)
+
+
+def _parse_arpa_float(s):
+    x = float(s)
+    return -math.inf if x <= ARPA_LOG_ZERO else x
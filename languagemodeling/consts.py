@@ -1,16 +1,40 @@
 MODELS_DIR = 'models'
 
+# binary model files (see languagemodeling.model_file)
+MODEL_MAGIC = b'PLNNGRAM'
+MODEL_VERSION = 1
+
 START_TOKEN = '<s>'
 END_TOKEN = '</s>'
 SEED = 96385
 
 TRAIN_PER = .9
 
+# tokens buffered by count_ngrams before adding them to the count table
+COUNT_CHUNK_SIZE = 2 ** 20
+# bytes of count tables kept in memory by count_ngrams_external before
+# spilling them to disk, and rows read at a time from each spilled run
+COUNT_MEMORY_BUDGET = 2 ** 30
+MERGE_BLOCK_SIZE = 2 ** 18
+
+# sentences generated in lockstep by each random stream of generate_sents
+GENERATE_STREAM_SIZE = 2 ** 12
+
 # InterpolatedNGram gamma grid search
 GAMMA_MIN = 30
 GAMMA_MAX = 130
 GAMMA_LINSP_NUM = 11
 
+# KneserNeyNGram discounts for counts 1, 2 and 3 or more, used if there are
+# too few k-grams to estimate them
+KN_DISCOUNTS = [.5, 1., 1.5]
+
 BETA_MIN = .3
 BETA_MAX = .8
 BETA_LINSP_NUM = 6
+
+# longest sentence that SentSorter reorders exactly with bigram models
+SORT_EXACT_MAX_LEN = 14
+# log-probability used in place of -inf by the exact reordering, so that
+# orderings through impossible transitions are still ranked
+SORT_LOG_ZERO = -1e9
@@ -0,0 +1,686 @@
+from bisect import bisect_left
+from collections import defaultdict, deque
+from collections.abc import Mapping
+from multiprocessing import Pool
+import struct
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from languagemodeling.consts import START_TOKEN, END_TOKEN, COUNT_CHUNK_SIZE
+
+
+# ids are stored big-endian so that comparing the raw bytes of a packed key
+# gives the same (lexicographic) order as comparing the ids themselves
+ID_DTYPE = np.dtype('>u4')
+UNK_ID = np.iinfo(np.uint32).max
+
+
+def key_dtype(k):
+    """Dtype of a packed k-gram key (k > 0)."""
+    return np.dtype((np.void, k * ID_DTYPE.itemsize))
+
+
+def pack_keys(ids):
+    """Pack a (m, k) array of ids into a 1-d array of sortable keys.
+
+    ids -- the (m, k) id array.
+    """
+    ids = np.ascontiguousarray(ids, dtype=ID_DTYPE)
+    return ids.view(key_dtype(ids.shape[1])).reshape(-1)
+
+
+def unpack_keys(keys, k):
+    """Inverse of pack_keys.
+
+    keys -- 1-d array of packed k-gram keys.
+    k -- the order of the keys.
+    """
+    return keys.view(ID_DTYPE).reshape(-1, k)
+
+
+def find_keys(keys, ids):
+    """Positions of some k-grams in a sorted array of packed keys (-1 if
+    missing).
+
+    keys -- 1-d sorted array of packed k-gram keys.
+    ids -- (m, k) array with the ids of the k-grams.
+    """
+    if len(keys) == 0:
+        return np.full(len(ids), -1, dtype=np.int64)
+    query = pack_keys(ids)
+    rows = np.minimum(keys.searchsorted(query), len(keys) - 1)
+    return np.where(keys[rows] == query, rows, -1)
+
+
+def merge_tables(keys_list, counts_list):
+    """Merge several count tables of the same order, adding up the counts.
+
+    keys_list -- list of 1-d packed key arrays.
+    counts_list -- list of count arrays, aligned with keys_list.
+    """
+    keys = np.concatenate(keys_list)
+    counts = np.concatenate(counts_list).astype(np.int64, copy=False)
+    # stable sort is a merge sort, so already sorted runs are cheap to merge
+    order = np.argsort(keys, kind='stable')
+    keys = keys[order]
+    counts = counts[order]
+    if len(keys) == 0:
+        return keys, counts
+
+    new = np.empty(len(keys), dtype=bool)
+    new[0] = True
+    new[1:] = keys[1:] != keys[:-1]
+    starts = np.flatnonzero(new)
+    return keys[starts], np.add.reduceat(counts, starts)
+
+
+class Vocabulary(object):
+
+    def __init__(self, tokens=()):
+        """
+        tokens -- initial tokens (START_TOKEN and END_TOKEN are always
+            included, with ids 0 and 1).
+        """
+        self._ids = {}
+        self._tokens = []
+        self.add(START_TOKEN)
+        self.add(END_TOKEN)
+        for token in tokens:
+            self.add(token)
+
+    def add(self, token):
+        """Id of a token, adding it to the vocabulary if needed.
+
+        token -- the token.
+        """
+        i = self._ids.get(token)
+        if i is None:
+            i = self._ids[token] = len(self._tokens)
+            self._tokens.append(token)
+        return i
+
+    def add_all(self, tokens):
+        """List of ids of the tokens, adding the unknown ones.
+
+        tokens -- the tokens.
+        """
+        add = self.add
+        return [add(token) for token in tokens]
+
+    def id(self, token):
+        """Id of a token (UNK_ID if the token is unknown).
+
+        token -- the token.
+        """
+        return self._ids.get(token, UNK_ID)
+
+    def ids(self, tokens):
+        """List of ids of the tokens (UNK_ID for the unknown ones).
+
+        tokens -- the tokens.
+        """
+        get = self._ids.get
+        return [get(token, UNK_ID) for token in tokens]
+
+    def token(self, i):
+        """Token with a given id.
+
+        i -- the id.
+        """
+        return self._tokens[i]
+
+    def tokens(self):
+        """List of tokens, indexed by id."""
+        return self._tokens
+
+    def __len__(self):
+        return len(self._tokens)
+
+    def __contains__(self, token):
+        return token in self._ids
+
+    def __iter__(self):
+        return iter(self._tokens)
+
+    def __getstate__(self):
+        # the ids are the positions in the list of tokens
+        return {'_tokens': self._tokens}
+
+    def __setstate__(self, state):
+        self._tokens = state['_tokens']
+        self._ids = {token: i for i, token in enumerate(self._tokens)}
+
+
+class NGramCounts(Mapping):
+    """Count table for k-grams, stored as one sorted key array per order.
+
+    Behaves as a read-only mapping from token tuples to counts. The empty
+    tuple maps to the total number of tokens.
+    """
+
+    def __init__(self, vocab=None):
+        """
+        vocab -- the Vocabulary (a new one if not given).
+        """
+        self._vocab = vocab if vocab is not None else Vocabulary()
+        self._total = 0
+        self._keys = {}
+        self._counts = {}
+        self._views = {}
+
+    def vocab(self):
+        """The Vocabulary used to encode the k-grams."""
+        return self._vocab
+
+    def orders(self):
+        """Sorted list of the orders k > 0 stored in the table."""
+        return sorted(self._keys)
+
+    def table(self, k):
+        """Ids and counts of the stored k-grams, as a (m, k) array and a
+        length m array, sorted by ids.
+
+        k -- the order (k > 0).
+        """
+        keys = self._keys.get(k, np.empty(0, dtype=key_dtype(k)))
+        counts = self._counts.get(k, np.empty(0, dtype=np.int64))
+        return unpack_keys(keys, k), counts
+
+    def add(self, k, ids, counts=None):
+        """Add k-gram counts to the table.
+
+        k -- the order (k > 0).
+        ids -- (m, k) array with the ids of the k-grams.
+        counts -- the count of each k-gram (default: 1 each).
+        """
+        ids = np.asarray(ids).reshape(-1, k)
+        if counts is None:
+            counts = np.ones(len(ids), dtype=np.int64)
+        self._merge(k, [pack_keys(ids)], [np.asarray(counts, dtype=np.int64)])
+
+    def add_counts(self, *others):
+        """Add the counts of other tables, that may use other vocabularies.
+
+        others -- the NGramCounts to add.
+        """
+        keys = defaultdict(list)
+        counts = defaultdict(list)
+        for other in others:
+            tokens = other.vocab().tokens()
+            remap = np.array(self._vocab.add_all(tokens), dtype=np.uint32)
+            same_ids = np.array_equal(remap, np.arange(len(tokens)))
+            self._total += other._total
+            for k in other.orders():
+                if same_ids:
+                    keys[k].append(other._keys[k])
+                else:
+                    ids, _ = other.table(k)
+                    keys[k].append(pack_keys(remap[ids]))
+                counts[k].append(other._counts[k])
+        for k in sorted(keys):
+            self._merge(k, keys[k], counts[k])
+
+    def _merge(self, k, keys, counts):
+        # merge sorted or unsorted key/count arrays into the table of order k
+        if k in self._keys:
+            keys = [self._keys[k]] + keys
+            counts = [self._counts[k]] + counts
+        self._keys[k], self._counts[k] = merge_tables(keys, counts)
+        self._views = {}
+
+    def add_total(self, count):
+        """Add to the count of the empty k-gram.
+
+        count -- the number of tokens to add.
+        """
+        self._total += int(count)
+
+    def find(self, k, ids):
+        """Rows of some k-grams in the table of order k (-1 if missing).
+
+        k -- the order (k > 0).
+        ids -- (m, k) array with the ids of the k-grams.
+        """
+        ids = np.asarray(ids).reshape(-1, k)
+        keys = self._keys.get(k)
+        if keys is None:
+            return np.full(len(ids), -1, dtype=np.int64)
+        return find_keys(keys, ids)
+
+    def lookup(self, k, ids):
+        """Counts of some k-grams (0 if missing).
+
+        k -- the order (k >= 0).
+        ids -- (m, k) array with the ids of the k-grams.
+        """
+        if k == 0:
+            return np.full(len(ids), self._total, dtype=np.int64)
+        ids = np.asarray(ids).reshape(-1, k)
+        counts = self._counts.get(k)
+        if counts is None or len(counts) == 0:
+            return np.zeros(len(ids), dtype=np.int64)
+        rows = self.find(k, ids)
+        return np.where(rows >= 0, counts[rows], 0)
+
+    def row(self, ids):
+        """Row of a k-gram given as a sequence of ids (-1 if missing).
+
+        ids -- the ids of the k-gram (k > 0).
+        """
+        k = len(ids)
+        keys = self._keys.get(k)
+        if keys is None or UNK_ID in ids:
+            return -1
+        key = _STRUCTS[k].pack(*ids)
+        i = int(keys.searchsorted(np.void(key)))
+        if i < len(keys) and self._view(k, 'keys')[i] == key:
+            return i
+        return -1
+
+    def count_ids(self, ids):
+        """Count of a k-gram given as a sequence of ids (None if missing).
+
+        ids -- the ids of the k-gram.
+        """
+        if not ids:
+            return self._total
+        i = self.row(ids)
+        if i < 0:
+            return None
+        return self._view(len(ids), 'counts')[i]
+
+    def parents(self, k):
+        """Rows of the prefixes of the k-grams in the table of order k - 1
+        (-1 if missing).
+
+        k -- the order (k > 0).
+        """
+        ids, _ = self.table(k)
+        if k == 1:
+            return np.zeros(len(ids), dtype=np.int64)
+        return self.find(k - 1, ids[:, :-1])
+
+    def successors(self, ids):
+        """Ids and counts of the tokens seen after a context, sorted by id.
+
+        ids -- the ids of the context.
+        """
+        k = len(ids) + 1
+        keys = self._keys.get(k)
+        if keys is None or UNK_ID in ids:
+            return np.empty(0, dtype=np.uint32), np.empty(0, dtype=np.int64)
+        lo = keys.searchsorted(np.void(_STRUCTS[k].pack(*ids, 0)))
+        hi = keys.searchsorted(np.void(_STRUCTS[k].pack(*ids, UNK_ID)))
+        table_ids, counts = self.table(k)
+        return table_ids[lo:hi, -1].astype(np.uint32), counts[lo:hi]
+
+    def count_pair(self, prev_tokens, token):
+        """Counts of a context and of the context followed by a token.
+
+        prev_tokens -- the context tuple.
+        token -- the token.
+        """
+        ids = self._vocab.ids(prev_tokens)
+        ngram = ids + [self._vocab.id(token)]
+        return self.count_ids(ids) or 0, self.count_ids(ngram) or 0
+
+    def suffix_counts(self, prev_tokens, token):
+        """count_pair for every suffix of a context, from the empty one to
+        the full context.
+
+        prev_tokens -- the context tuple.
+        token -- the token.
+        """
+        ids = self._vocab.ids(prev_tokens)
+        token_id = self._vocab.id(token)
+        result = []
+        for j in range(len(ids) + 1):
+            suffix = ids[len(ids) - j:]
+            result.append((self.count_ids(suffix) or 0,
+                           self.count_ids(suffix + [token_id]) or 0))
+        return result
+
+    def nbytes(self):
+        """Bytes used by the count arrays (the vocabulary excluded)."""
+        return sum(a.nbytes for a in self._arrays())
+
+    def _arrays(self):
+        yield from self._keys.values()
+        yield from self._counts.values()
+
+    def _view(self, k, name):
+        # memoryviews of the arrays, for fast access from python: the keys
+        # as bytes and the counts as ints
+        view = self._views.get((k, name))
+        if view is None:
+            if name == 'keys':
+                view = _KeyView(self._keys[k])
+            else:
+                view = memoryview(self._counts[k]).cast('B').cast('q')
+            self._views[k, name] = view
+        return view
+
+    def get(self, tokens, default=None):
+        c = self.count_ids(self._vocab.ids(tokens))
+        return default if c is None else c
+
+    def __getitem__(self, tokens):
+        c = self.count_ids(self._vocab.ids(tokens))
+        if c is None:
+            raise KeyError(tokens)
+        return c
+
+    def __contains__(self, tokens):
+        return self.count_ids(self._vocab.ids(tokens)) is not None
+
+    def __iter__(self):
+        yield ()
+        tokens = self._vocab.tokens()
+        for k in self.orders():
+            ids, _ = self.table(k)
+            for row in ids.tolist():
+                yield tuple(tokens[i] for i in row)
+
+    def __len__(self):
+        return 1 + sum(len(keys) for keys in self._keys.values())
+
+    def items(self):
+        return zip(iter(self), self._all_counts())
+
+    def values(self):
+        return self._all_counts()
+
+    def _all_counts(self):
+        yield self._total
+        for k in self.orders():
+            yield from self._counts[k].tolist()
+
+    def __getstate__(self):
+        # memoryviews can not be pickled, they are rebuilt when needed
+        state = self.__dict__.copy()
+        state['_views'] = {}
+        return state
+
+
+class _KeyView(object):
+    # bytes of the i-th packed key of an array
+
+    def __init__(self, keys):
+        self._bytes = memoryview(keys.view(np.uint8))
+        self._size = keys.dtype.itemsize
+
+    def __getitem__(self, i):
+        size = self._size
+        return self._bytes[i * size:(i + 1) * size]
+
+
+class _Structs(dict):
+    # struct.Struct to pack the ids of a k-gram, by k
+
+    def __missing__(self, k):
+        s = self[k] = struct.Struct('>%dI' % k)
+        return s
+
+
+_STRUCTS = _Structs()
+
+
+class TrieCounts(NGramCounts):
+    """NGramCounts with a context trie built on top of the sorted tables.
+
+    Every stored k-gram is a node. Its successors are a contiguous range of
+    the table of order k + 1, sorted by their last id, and its extensions to
+    the left are a contiguous range of the same table sorted by suffix. The
+    counts of a context and of all its suffixes, with and without a given
+    token at the end, are then found in a single descent from the root.
+    """
+
+    def __init__(self, vocab=None):
+        """
+        vocab -- the Vocabulary (a new one if not given).
+        """
+        super().__init__(vocab)
+        self._trie = None
+        self._trie_views = None
+
+    def _merge(self, k, keys, counts):
+        super()._merge(k, keys, counts)
+        self._trie = None
+        self._trie_views = None
+
+    def _arrays(self):
+        yield from super()._arrays()
+        self._get_trie()
+        for arrays in self._trie.values():
+            yield from arrays.values()
+
+    def _build_trie(self):
+        # last[k]: last id of each k-gram, in table order.
+        # succ_lo[k], succ_hi[k]: range of the successors of each k-gram in
+        #   the table of order k + 1.
+        # rows[k]: table rows of the k-grams sorted by (suffix, first id).
+        # first[k]: first id of each k-gram, in that order.
+        # ext_lo[k], ext_hi[k]: range of the left extensions of each k-gram
+        #   in rows[k + 1].
+        names = ['last', 'succ_lo', 'succ_hi', 'rows', 'first', 'ext_lo', 'ext_hi']
+        trie = {name: {} for name in names}
+        for k in self.orders():
+            ids, _ = self.table(k)
+            trie['last'][k] = np.ascontiguousarray(ids[:, -1], dtype=np.uint32)
+            order = np.argsort(pack_keys(np.roll(ids, -1, axis=1)), kind='stable')
+            trie['rows'][k] = order.astype(np.int64)
+            trie['first'][k] = np.ascontiguousarray(ids[order, 0], dtype=np.uint32)
+
+            if k == 1:
+                trie['succ_lo'][0] = trie['ext_lo'][0] = np.zeros(1, dtype=np.int64)
+                trie['succ_hi'][0] = trie['ext_hi'][0] = np.full(1, len(ids), dtype=np.int64)
+            elif k - 1 in self._keys:
+                parents = self._keys[k - 1]
+                prefixes = pack_keys(ids[:, :-1])
+                trie['succ_lo'][k - 1] = prefixes.searchsorted(parents, 'left')
+                trie['succ_hi'][k - 1] = prefixes.searchsorted(parents, 'right')
+                suffixes = pack_keys(ids[order, 1:])
+                trie['ext_lo'][k - 1] = suffixes.searchsorted(parents, 'left')
+                trie['ext_hi'][k - 1] = suffixes.searchsorted(parents, 'right')
+        self._trie = trie
+
+    def _get_trie(self):
+        if self._trie is None:
+            self._build_trie()
+        if self._trie_views is None:
+            # memoryviews for the descent, where python ints are faster than
+            # numpy scalars
+            self._trie_views = views = {}
+            for name, arrays in self._trie.items():
+                views[name] = {k: memoryview(a).cast('B').cast(a.dtype.char)
+                               for k, a in arrays.items()}
+        return self._trie_views
+
+    def count_pair(self, prev_tokens, token):
+        trie = self._get_trie()
+        ids = self._vocab.ids(prev_tokens)
+        k = len(ids)
+        if k not in trie['succ_lo']:
+            return super().count_pair(prev_tokens, token)
+
+        if k == 0:
+            row = 0
+            c_prev = self._total
+        else:
+            row = self.row(ids)
+            if row < 0:
+                return 0, 0
+            c_prev = self._view(k, 'counts')[row]
+        i = _search(trie['last'][k + 1], trie['succ_lo'][k][row],
+                    trie['succ_hi'][k][row], self._vocab.id(token))
+        return c_prev, 0 if i < 0 else self._view(k + 1, 'counts')[i]
+
+    def suffix_counts(self, prev_tokens, token):
+        trie = self._get_trie()
+        ids = self._vocab.ids(prev_tokens)
+        if any(k not in trie['ext_lo'] for k in range(len(ids))):
+            # the lower order k-grams were not counted, so there is no root
+            return super().suffix_counts(prev_tokens, token)
+
+        token_id = self._vocab.id(token)
+        result = []
+        c_prev = self._total
+        row = 0
+        for k in range(len(ids) + 1):
+            c = 0
+            if k in trie['succ_lo']:
+                i = _search(trie['last'][k + 1], trie['succ_lo'][k][row],
+                            trie['succ_hi'][k][row], token_id)
+                if i >= 0:
+                    c = self._view(k + 1, 'counts')[i]
+            result.append((c_prev, c))
+            if k == len(ids):
+                break
+
+            # extend the context one token to the left
+            i = _search(trie['first'][k + 1], trie['ext_lo'][k][row],
+                        trie['ext_hi'][k][row], ids[-k - 1])
+            if i < 0:
+                result += [(0, 0)] * (len(ids) - k)
+                break
+            row = trie['rows'][k + 1][i]
+            c_prev = self._view(k + 1, 'counts')[row]
+        return result
+
+    def __getstate__(self):
+        state = super().__getstate__()
+        state['_trie_views'] = None
+        return state
+
+
+def _search(ids, lo, hi, i):
+    # position of id i in the sorted range ids[lo:hi], or -1
+    j = bisect_left(ids, i, lo, hi)
+    if j < hi and ids[j] == i:
+        return j
+    return -1
+
+
+STORES = {
+    'array': NGramCounts,
+    'trie': TrieCounts,
+}
+
+
+def count_ngrams(sents, n, all_ngrams=False, store='array', workers=1,
+                 chunk_size=COUNT_CHUNK_SIZE):
+    """Count the k-grams of a list or iterable of sentences.
+
+    The sentences are padded with n - 1 START_TOKENs and one END_TOKEN. All
+    k-grams with max(n - 1, 1) <= k <= n are counted, or 1 <= k <= n if
+    all_ngrams is True. The empty k-gram counts the tokens, including
+    END_TOKENs.
+
+    sents -- the sentences, each one being a list of tokens.
+    n -- order of the model.
+    all_ngrams -- whether to count the lower order k-grams.
+    store -- name of the count store, one of STORES (default: 'array').
+    workers -- number of processes counting in parallel (default: 1). The
+        result does not depend on it.
+    chunk_size -- number of tokens to buffer before adding them to the table
+        (and to send to each worker).
+    """
+    if workers > 1:
+        return _count_ngrams_parallel(sents, n, all_ngrams, store, workers,
+                                      chunk_size)
+
+    counts = STORES[store]()
+    vocab = counts.vocab()
+    min_ngram = 1 if all_ngrams else max(n - 1, 1)
+    orders = range(min_ngram, n + 1)
+    start_id = vocab.id(START_TOKEN)
+    end_id = vocab.id(END_TOKEN)
+    pad = [start_id] * (n - 1)
+
+    num_sents = 0
+    ids = []
+    lengths = []
+    for sent in sents:
+        num_sents += 1
+        ids += pad
+        ids += vocab.add_all(sent)
+        ids.append(end_id)
+        lengths.append(len(sent) + n)
+        if len(ids) >= chunk_size:
+            _count_chunk(counts, ids, lengths, n, orders)
+            ids = []
+            lengths = []
+    if ids:
+        _count_chunk(counts, ids, lengths, n, orders)
+
+    if num_sents:
+        for k in range(min_ngram, n):
+            counts.add(k, [[start_id] * k], [num_sents])
+
+    return counts
+
+
+def _count_chunk(counts, ids, lengths, n, orders):
+    # ids are the padded sentences one after the other. A window is counted
+    # iff its last token is not padding, so it never crosses a sentence
+    # boundary (there are n - 1 START_TOKENs at the beginning of each one).
+    ids = np.array(ids, dtype=np.uint32)
+    real = np.ones(len(ids), dtype=bool)
+    if n > 1:
+        starts = np.cumsum(lengths) - lengths
+        real[(starts[:, None] + np.arange(n - 1)).reshape(-1)] = False
+
+    counts.add_total(np.count_nonzero(real))
+    for k in orders:
+        windows = sliding_window_view(ids, k)[real[k - 1:]]
+        counts.add(k, windows)
+
+
+def _count_ngrams_parallel(sents, n, all_ngrams, store, workers, chunk_size):
+    # Each worker counts a shard of consecutive sentences with its own
+    # vocabulary. The shards are added in order, so the ids (given by first
+    # occurrence) and thus the tables are the same as when counting serially.
+    # The partial tables are added in batches at least as big as the table,
+    # so each row is merged O(log(shards)) times.
+    counts = STORES[store]()
+    pending = []
+    pending_size = 0
+
+    def add(shard_counts):
+        nonlocal pending, pending_size
+        pending.append(shard_counts)
+        pending_size += len(shard_counts)
+        if pending_size >= len(counts):
+            counts.add_counts(*pending)
+            pending = []
+            pending_size = 0
+
+    with Pool(workers) as pool:
+        # a bounded number of shards in flight, to bound memory
+        results = deque()
+        for shard in _shards(sents, chunk_size):
+            results.append(pool.apply_async(
+                count_ngrams, (shard, n, all_ngrams, 'array', 1, chunk_size)))
+            if len(results) > 2 * workers:
+                add(results.popleft().get())
+        while results:
+            add(results.popleft().get())
+
+    counts.add_counts(*pending)
+    return counts
+
+
+def _shards(sents, size):
+    # lists of consecutive sentences with about size tokens each
+    shard = []
+    num_tokens = 0
+    for sent in sents:
+        shard.append(sent)
+        num_tokens += len(sent) + 1
+        if num_tokens >= size:
+            yield shard
+            shard = []
+            num_tokens = 0
+    if shard:
+        yield shard
@@ -0,0 +1,229 @@
+"""N-gram counting in bounded memory.
+
+The counts are accumulated in memory until their tables reach a budget, and
+then spilled to disk as sorted runs. At the end the runs of each order are
+merged block by block and written to a model file with the count tables,
+that can be loaded with model_file.load_model and given to the n-gram models
+in place of the sentences.
+
+The count tables of models trained on separate shards of a corpus are merged
+the same way, as sorted runs, into the counts of a single model.
+"""
+import os
+import tempfile
+
+import numpy as np
+
+from languagemodeling.consts import COUNT_CHUNK_SIZE, COUNT_MEMORY_BUDGET, \
+    MERGE_BLOCK_SIZE
+from languagemodeling.counts import STORES, NGramCounts, Vocabulary, \
+    count_ngrams, key_dtype, merge_tables, pack_keys, _shards
+from languagemodeling.model_file import save_model, load_model
+from languagemodeling.ngram import NGram, InterpolatedNGram, BackOffNGram
+
+
+def count_ngrams_external(sents, n, filename, all_ngrams=False, store='array',
+                          max_bytes=COUNT_MEMORY_BUDGET, tmpdir=None,
+                          chunk_size=COUNT_CHUNK_SIZE):
+    """Count the k-grams of an iterable of sentences with bounded memory, and
+    save the counts in a model file. See count_ngrams.
+
+    Returns the counts, memory-mapped from the file.
+
+    sents -- the sentences, each one being a list of tokens.
+    n -- order of the model.
+    filename -- name of the output file.
+    all_ngrams -- whether to count the lower order k-grams.
+    store -- name of the count store, one of STORES (default: 'array').
+    max_bytes -- size of the count tables kept in memory before spilling
+        them to disk.
+    tmpdir -- directory for the spilled runs (default: the system one).
+    chunk_size -- number of tokens counted at a time.
+    """
+    with tempfile.TemporaryDirectory(dir=tmpdir) as tmp:
+        # the runs share the vocabulary, so their ids can be merged as is
+        total = 0
+        runs = []
+        counts = NGramCounts()
+        for shard in _shards(sents, chunk_size):
+            counts.add_counts(count_ngrams(shard, n, all_ngrams,
+                                           chunk_size=chunk_size))
+            if counts.nbytes() >= max_bytes:
+                runs.append(_spill(counts, tmp, len(runs)))
+                total += counts[()]
+                counts = NGramCounts(counts.vocab())
+        runs.append(_spill(counts, tmp, len(runs)))
+        total += counts[()]
+
+        _save_merged(counts.vocab(), total, runs, store, filename, tmp)
+
+    return load_model(filename)
+
+
+def merge_counts(counts_list, filename, store='array',
+                 max_bytes=COUNT_MEMORY_BUDGET, tmpdir=None):
+    """Merge the count tables of models trained on separate shards of a
+    corpus, and save them in a model file. The tables must have the same
+    orders (same n and all_ngrams).
+
+    The vocabularies are joined in order, so the result is the same as
+    counting the shards one after the other. The tables are merged as sorted
+    runs, so only max_bytes of them are held in memory at a time besides
+    the vocabulary.
+
+    Returns the counts, memory-mapped from the file.
+
+    counts_list -- the NGramCounts to merge.
+    filename -- name of the output file.
+    store -- name of the count store, one of STORES (default: 'array').
+    max_bytes -- size of the count tables sorted in memory at a time, for
+        the tables whose ids change in the joined vocabulary.
+    tmpdir -- directory for the re-sorted runs (default: the system one).
+    """
+    orders = {tuple(counts.orders()) for counts in counts_list}
+    if len(orders) != 1:
+        raise ValueError('the counts have different orders: {}'.format(
+            sorted(orders)))
+
+    with tempfile.TemporaryDirectory(dir=tmpdir) as tmp:
+        vocab = Vocabulary()
+        total = 0
+        runs = []
+        for i, counts in enumerate(counts_list):
+            tokens = counts.vocab().tokens()
+            remap = np.array(vocab.add_all(tokens), dtype=np.uint32)
+            total += counts[()]
+            if np.array_equal(remap, np.arange(len(tokens))):
+                # same ids, the tables are already sorted runs
+                runs.append({k: (counts._keys[k], counts._counts[k])
+                             for k in counts.orders()})
+            else:
+                runs.extend(_remap_runs(counts, remap, tmp, i, max_bytes))
+
+        _save_merged(vocab, total, runs, store, filename, tmp)
+
+    return load_model(filename)
+
+
+def merge_models(models, filename, store='array', held_out=None,
+                 max_bytes=COUNT_MEMORY_BUDGET, tmpdir=None):
+    """Merge n-gram models trained on separate shards of a corpus into a model
+    of the same class trained on all of them, without reading the sentences
+    again. See merge_counts.
+
+    The smoothing hyper-parameters (gamma, beta) are taken from the first
+    model, unless held-out data is given to re-estimate them.
+
+    models -- the models, with the same class, order and addone setting.
+    filename -- name of the file for the merged counts, that the model maps.
+    store -- name of the count store, one of STORES (default: 'array').
+    held_out -- list of held-out sentences to re-estimate the
+        hyper-parameters on (optional).
+    max_bytes -- see merge_counts.
+    tmpdir -- see merge_counts.
+    """
+    first = models[0]
+    for model in models:
+        if not isinstance(model, NGram):
+            raise TypeError('can not merge a {}, it keeps no counts'.format(
+                type(model).__name__))
+        if type(model) is not type(first) or model._n != first._n or \
+                model._addone != first._addone:
+            raise ValueError('can not merge {} {}-gram and {} {}-gram models'.format(
+                type(first).__name__, first._n, type(model).__name__, model._n))
+
+    counts = merge_counts([model._count for model in models], filename,
+                          store=store, max_bytes=max_bytes, tmpdir=tmpdir)
+    cls = type(first)
+    if isinstance(first, InterpolatedNGram):
+        # unigram models have no gamma, any value avoids the held-out split
+        merged = cls(first._n, counts, gamma=first._gamma or 0.0,
+                     addone=first._addone)
+    elif isinstance(first, BackOffNGram):
+        merged = cls(first._n, counts, beta=first._beta, addone=first._addone,
+                     cache_size=first._cache_size)
+    else:
+        merged = cls(first._n, counts)
+
+    if held_out is not None:
+        merged.update([], held_out=held_out)
+    return merged
+
+
+def _save_merged(vocab, total, runs, store, filename, tmp):
+    # merge the runs of each order into a count table and save it
+    merged = STORES[store](vocab)
+    merged.add_total(total)
+    for k in sorted({k for run in runs for k in run}):
+        tables = [run[k] for run in runs if k in run]
+        merged._keys[k], merged._counts[k] = \
+            _merge_runs(tables, k, tmp, MERGE_BLOCK_SIZE)
+
+    save_model(merged, filename)
+
+
+def _spill(counts, tmp, i):
+    # save the tables of counts as sorted runs, and map them back read-only
+    return {k: _save_run(counts._keys[k], counts._counts[k], tmp,
+                         'run{}-{}'.format(i, k))
+            for k in counts.orders()}
+
+
+def _remap_runs(counts, remap, tmp, i, max_bytes):
+    # The tables with the ids of the joined vocabulary are no longer sorted,
+    # so they are remapped and sorted in chunks of max_bytes, saved as runs.
+    for k in counts.orders():
+        ids, values = counts.table(k)
+        step = max(max_bytes // (k * ids.itemsize + values.itemsize), 1)
+        for j in range(0, len(ids), step):
+            keys, chunk_counts = merge_tables(
+                [pack_keys(remap[ids[j:j + step]])], [values[j:j + step]])
+            yield {k: _save_run(keys, chunk_counts, tmp,
+                                'shard{}-{}-{}'.format(i, k, j))}
+
+
+def _save_run(keys, counts, tmp, name):
+    keys_file = os.path.join(tmp, name + '.keys.npy')
+    counts_file = os.path.join(tmp, name + '.counts.npy')
+    np.save(keys_file, keys)
+    np.save(counts_file, counts)
+    return (np.load(keys_file, mmap_mode='r'),
+            np.load(counts_file, mmap_mode='r'))
+
+
+def _merge_runs(runs, k, tmp, block_size):
+    # k-way merge of sorted runs of order k, adding up the counts of the
+    # same keys. Every step merges up to the smallest of the last keys of the
+    # next block of each run, so no smaller key can show up later.
+    keys_file = os.path.join(tmp, 'merged-{}.keys'.format(k))
+    counts_file = os.path.join(tmp, 'merged-{}.counts'.format(k))
+    pos = [0] * len(runs)
+    num_rows = 0
+    with open(keys_file, 'wb') as fk, open(counts_file, 'wb') as fc:
+        while True:
+            active = [i for i, (keys, _) in enumerate(runs) if pos[i] < len(keys)]
+            if not active:
+                break
+            cut = min(runs[i][0][min(pos[i] + block_size, len(runs[i][0])) - 1].tobytes()
+                      for i in active)
+            cut = np.void(cut)
+
+            keys_list = []
+            counts_list = []
+            for i in active:
+                keys, counts = runs[i]
+                block = keys[pos[i]:pos[i] + block_size]
+                end = pos[i] + int(block.searchsorted(cut, 'right'))
+                keys_list.append(np.asarray(keys[pos[i]:end]))
+                counts_list.append(np.asarray(counts[pos[i]:end]))
+                pos[i] = end
+
+            keys, counts = merge_tables(keys_list, counts_list)
+            fk.write(keys.tobytes())
+            fc.write(counts.tobytes())
+            num_rows += len(keys)
+
+    if num_rows == 0:
+        return np.empty(0, dtype=key_dtype(k)), np.empty(0, dtype=np.int64)
+    return (np.memmap(keys_file, dtype=key_dtype(k), mode='r', shape=(num_rows,)),
+            np.memmap(counts_file, dtype=np.int64, mode='r', shape=(num_rows,)))
@@ -0,0 +1,208 @@
+"""Binary file format for language models.
+
+A model file is made of:
+
+  - MODEL_MAGIC, the format version (uint32) and the length of the header
+    (uint64), little-endian.
+  - The header, a JSON document describing the model object: its class and
+    attributes. Scalars are stored in the header itself and numpy arrays are
+    stored as references to the data section.
+  - The data section, with every array aligned to ARRAY_ALIGN bytes.
+
+Loading maps the file in memory and the arrays of the model are read-only
+views of it, so loading does not depend on the size of the model and
+several processes loading the same file share its pages.
+"""
+import json
+import mmap
+import os
+import pickle
+import stat
+import struct
+import tempfile
+
+import numpy as np
+
+from languagemodeling.compiled import CompiledNGram, QuantizedNGram, load_arpa
+from languagemodeling.consts import MODEL_MAGIC, MODEL_VERSION
+from languagemodeling.counts import Vocabulary, NGramCounts, TrieCounts
+from languagemodeling.ngram import NGram, AddOneNGram, InterpolatedNGram, \
+    BackOffNGram, KneserNeyNGram
+
+
+ARRAY_ALIGN = 64
+# arrays are written in blocks of this size, so that memory-mapped arrays
+# are never read at once
+WRITE_BLOCK = 2 ** 24
+PREAMBLE = struct.Struct('<IQ')
+# bytes read to tell ARPA files apart from pickles
+ARPA_PEEK = 64
+
+# classes that can be stored in a model file, by name
+CLASSES = {cls.__name__: cls for cls in [
+    NGram, AddOneNGram, InterpolatedNGram, BackOffNGram, KneserNeyNGram,
+    CompiledNGram, QuantizedNGram,
+    NGramCounts, TrieCounts,
+]}
+
+
+def save_model(model, filename):
+    """Save a model in the binary format.
+
+    model -- the model.
+    filename -- name of the output file.
+    """
+    arrays = []
+    header = {'model': _encode(model, arrays), 'arrays': []}
+
+    offset = 0
+    for a in arrays:
+        header['arrays'].append({
+            'dtype': a.dtype.str,
+            'shape': list(a.shape),
+            'offset': offset,
+        })
+        offset = _align(offset + a.nbytes)
+    infos = header['arrays']
+    header = json.dumps(header).encode('utf-8')
+
+    # The model may be mapped from the file it is saved to, so it is written
+    # to a new file that then replaces the old one.
+    f = tempfile.NamedTemporaryFile(dir=os.path.dirname(filename) or '.',
+                                    prefix='.model-', delete=False)
+    try:
+        with f:
+            f.write(MODEL_MAGIC)
+            f.write(PREAMBLE.pack(MODEL_VERSION, len(header)))
+            f.write(header)
+            data_start = _align(f.tell())
+            for a, info in zip(arrays, infos):
+                f.write(b'\0' * (data_start + info['offset'] - f.tell()))
+                _write_array(f, a)
+        os.chmod(f.name, _file_mode(filename))
+        os.replace(f.name, filename)
+    except BaseException:
+        os.unlink(f.name)
+        raise
+
+
+def load_model(filename):
+    """Load a model saved with save_model, with pickle or as an ARPA file.
+
+    filename -- name of the model file.
+    """
+    with open(filename, 'rb') as f:
+        magic = f.read(len(MODEL_MAGIC))
+        if magic != MODEL_MAGIC:
+            f.seek(0)
+            if f.read(ARPA_PEEK).lstrip().startswith(b'\\data\\'):
+                return load_arpa(filename)
+            f.seek(0)
+            return pickle.load(f)
+
+        version, header_len = PREAMBLE.unpack(f.read(PREAMBLE.size))
+        if version != MODEL_VERSION:
+            raise ValueError('unsupported model file version {}'.format(version))
+        header = json.loads(f.read(header_len).decode('utf-8'))
+        data_start = _align(f.tell())
+        # the map outlives the file object, the arrays keep a reference to it
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    arrays = []
+    for info in header['arrays']:
+        dtype = np.dtype(info['dtype'])
+        shape = tuple(info['shape'])
+        count = int(np.prod(shape))
+        if count == 0:
+            a = np.empty(shape, dtype=dtype)
+        else:
+            a = np.frombuffer(mm, dtype=dtype, count=count,
+                              offset=data_start + info['offset'])
+        arrays.append(a.reshape(shape))
+
+    return _decode(header['model'], arrays)
+
+
+def _file_mode(filename):
+    # mode of the file as open(filename, 'w') leaves it: kept if it exists,
+    # else the default one less the umask
+    try:
+        return stat.S_IMODE(os.stat(filename).st_mode)
+    except FileNotFoundError:
+        umask = os.umask(0)
+        os.umask(umask)
+        return 0o666 & ~umask
+
+
+def _write_array(f, a):
+    a = a.reshape(-1)
+    step = max(WRITE_BLOCK // max(a.itemsize, 1), 1)
+    for i in range(0, len(a), step):
+        f.write(np.ascontiguousarray(a[i:i + step]).tobytes())
+
+
+def _align(offset):
+    return -(-offset // ARRAY_ALIGN) * ARRAY_ALIGN
+
+
+def _encode(value, arrays):
+    # JSON encoding of an attribute value, appending its arrays to arrays
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        arrays.append(value)
+        return {'type': 'array', 'index': len(arrays) - 1}
+    if isinstance(value, (list, tuple)):
+        return {'type': type(value).__name__,
+                'items': [_encode(v, arrays) for v in value]}
+    if isinstance(value, dict):
+        return {'type': 'dict',
+                'items': [[_encode(k, arrays), _encode(v, arrays)]
+                          for k, v in value.items()]}
+    if isinstance(value, Vocabulary):
+        tokens = [token.encode('utf-8') for token in value.tokens()]
+        lengths = np.array([len(token) for token in tokens], dtype=np.int64)
+        data = np.frombuffer(b''.join(tokens), dtype=np.uint8)
+        return {'type': 'vocabulary',
+                'lengths': _encode(lengths, arrays),
+                'data': _encode(data, arrays)}
+    name = type(value).__name__
+    if CLASSES.get(name) is type(value):
+        if hasattr(value, '__getstate__'):
+            state = value.__getstate__()
+        else:
+            state = vars(value)
+        return {'type': 'object', 'class': name,
+                'state': {k: _encode(v, arrays) for k, v in state.items()}}
+    raise TypeError('can not store {!r} in a model file'.format(value))
+
+
+def _decode(value, arrays):
+    if not isinstance(value, dict):
+        return value
+    t = value['type']
+    if t == 'array':
+        return arrays[value['index']]
+    if t == 'list':
+        return [_decode(v, arrays) for v in value['items']]
+    if t == 'tuple':
+        return tuple(_decode(v, arrays) for v in value['items'])
+    if t == 'dict':
+        return {_decode(k, arrays): _decode(v, arrays) for k, v in value['items']}
+    if t == 'vocabulary':
+        lengths = _decode(value['lengths'], arrays)
+        data = _decode(value['data'], arrays).tobytes()
+        ends = np.cumsum(lengths).tolist()
+        starts = [0] + ends[:-1]
+        return Vocabulary(data[i:j].decode('utf-8') for i, j in zip(starts, ends))
+    if t == 'object':
+        obj = CLASSES[value['class']].__new__(CLASSES[value['class']])
+        state = {k: _decode(v, arrays) for k, v in value['state'].items()}
+        if hasattr(obj, '__setstate__'):
+            obj.__setstate__(state)
+        else:
+            obj.__dict__.update(state)
+        return obj
+    raise ValueError('unknown value type in model file: {}'.format(t))
@@ -1,9 +1,14 @@
 # https://docs.python.org/3/library/collections.html
-from collections import defaultdict
+from collections.abc import Sequence
+from concurrent.futures import ThreadPoolExecutor
 import math
+import time
 import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 
+from languagemodeling.cache import LRUCache
 from languagemodeling.consts import *
+from languagemodeling.counts import NGramCounts, UNK_ID, count_ngrams, _shards
 
 
 class LanguageModel(object):
@@ -22,15 +27,20 @@ class LanguageModel(object):
         """
         return -math.inf
 
+    def score_batch(self, sents):
+        """Log-probabilities of a list of sentences, as an array.
+
+        sents -- the sentences.
+        """
+        return np.array([self.sent_log_prob(sent) for sent in sents],
+                        dtype=np.float64)
+
     def log_prob(self, sents):
         """Log-probability of a list of sentences.
 
         sents -- the sentences.
         """
-        log_p = 0
-        for sent in sents:
-            log_p += self.sent_log_prob(sent)
-        return log_p
+        return float(self.score_batch(sents).sum())
 
     def cross_entropy(self, sents):
         """Cross-entropy of a list of sentences.
@@ -49,45 +59,158 @@ class LanguageModel(object):
         return 2 ** self.cross_entropy(sents)
 
 
-class NGram(LanguageModel):
+class BaseNGram(LanguageModel):
+    """N-gram model that scores the n-grams of a batch of sentences at once.
 
-    def __init__(self, n, sents):
-        """
-        n -- order of the model.
-        sents -- list of sentences, each one being a list of tokens.
+    Subclasses define vocab, cond_prob and _cond_probs, the conditional
+    probability of the last token of each row of an array of n-gram ids.
+    """
+
+    def sent_prob(self, sent):
+        """Probability of a sentence. Warning: subject to underflow problems.
+
+        sent -- the sentence as a list of tokens.
         """
-        assert n > 0
-        self._n = n
-        self._addone = False
+        n = self._n
+        p = 1
+        sent = [START_TOKEN] * (n - 1) + sent + [END_TOKEN]
+        for i in range(len(sent) - n + 1):
+            token = sent[i + n - 1]
+            prev_tokens = tuple(sent[i:i + n - 1])
+            p *= self.cond_prob(token, prev_tokens)
+        return p
 
-        self._compute_counts(sents)
+    def sent_log_prob(self, sent):
+        """Log-probability of a sentence.
 
-    def _compute_counts(self, sents, all_ngrams=False):
-        print('Computing counts...')
+        sent -- the sentence as a list of tokens.
+        """
         n = self._n
-        self._count = count = defaultdict(int)
+        p = 0
+        sent = [START_TOKEN] * (n - 1) + sent + [END_TOKEN]
+        for i in range(len(sent) - n + 1):
+            token = sent[i + n - 1]
+            prev_tokens = tuple(sent[i:i + n - 1])
+            if self.cond_prob(token, prev_tokens) == 0:
+                return -math.inf
+            p += math.log(self.cond_prob(token, prev_tokens), 2)
+        return p
 
-        min_ngram = 1 if all_ngrams else max(n - 1, 1)
-        for i in range(min_ngram, n):
-            count[('<s>',) * i] += len(sents)
+    def score_batch(self, sents):
+        """Log-probabilities of a list of sentences, as an array. All the
+        n-grams of the batch are scored at once.
 
-        for sent in sents:
-            count[()] += len(sent) + 1
-            sent = [START_TOKEN] * (n - 1) + sent + [END_TOKEN]
+        sents -- the sentences.
+        """
+        ngrams, lengths = self._batch_ngrams(sents)
+        return self._sent_log_probs(self._cond_probs(ngrams), lengths)
 
-            for i in range(min_ngram, n + 1):
-                for j in range(n - i, len(sent) - i + 1):
-                    count[tuple(sent[j:j + i])] += 1
+    def evaluate(self, sents, scores_file=None, batch_size=COUNT_CHUNK_SIZE):
+        """Evaluate the model on a list or iterable of sentences, scoring
+        them once and by batches.
 
-        if self._addone:
-            print('Computing vocabulary...')
-            self._voc = voc = set()
-            for sent in sents:
-                for word in sent:
-                    voc.add(word)
-            voc.add(END_TOKEN)
+        Returns a dict with the log-probability, cross-entropy and
+        perplexity, the number of sentences and of tokens (including
+        END_TOKENs), the rate of tokens out of the vocabulary and the number
+        of tokens and sentences with probability 0.
 
-            self._V = len(voc)
+        sents -- the sentences.
+        scores_file -- file to write the log-probability and number of tokens
+            of each sentence to, one sentence per line (optional).
+        batch_size -- number of tokens to score at a time.
+        """
+        stats = _EvalStats()
+        for batch in _shards(sents, batch_size):
+            ngrams, lengths = self._batch_ngrams(batch)
+            scores = stats.add(self, ngrams, lengths)
+            if scores_file is not None:
+                for score, length in zip(scores.tolist(), lengths.tolist()):
+                    scores_file.write('{}\t{}\n'.format(score, length))
+
+        return stats.result()
+
+    def _sent_log_probs(self, probs, lengths):
+        # log-probability of each sentence, given those of its n-grams
+        if len(lengths) == 0:
+            return np.empty(0, dtype=np.float64)
+        with np.errstate(divide='ignore'):
+            log_probs = np.log2(probs)
+        starts = np.cumsum(lengths) - lengths
+        return np.add.reduceat(log_probs, starts)
+
+    def _batch_ngrams(self, sents):
+        return _batch_ngrams(self.vocab(), self._n, sents)
+
+
+class NGram(BaseNGram):
+
+    def __init__(self, n, sents, store='array', workers=1):
+        """
+        n -- order of the model.
+        sents -- list or iterable of sentences, each one being a list of
+            tokens, or their NGramCounts (see count_ngrams_external).
+        store -- count store to use, 'array' or 'trie' (default: 'array').
+        workers -- number of processes to count with (default: 1).
+        """
+        assert n > 0
+        self._n = n
+        self._addone = False
+
+        self._compute_counts(sents, store=store, workers=workers)
+
+    def _compute_counts(self, sents, all_ngrams=False, store='array',
+                        workers=1):
+        if isinstance(sents, NGramCounts):
+            # precomputed counts
+            min_ngram = 1 if all_ngrams else max(self._n - 1, 1)
+            missing = set(range(min_ngram, self._n + 1)) - set(sents.orders())
+            if missing or max(sents.orders()) != self._n:
+                raise ValueError('the counts are not for a {}-gram model{}'.format(
+                    self._n, ' with all k-grams' if all_ngrams else ''))
+            self._count = sents
+        else:
+            print('Computing counts...')
+            self._count = count_ngrams(sents, self._n, all_ngrams=all_ngrams,
+                                       store=store, workers=workers)
+        # END_TOKEN is part of the vocabulary but START_TOKEN is not
+        self._V = len(self._count.vocab()) - 1
+
+    def vocab(self):
+        """The Vocabulary of the model (tokens seen in training)."""
+        return self._count.vocab()
+
+    def update(self, sents, held_out=None):
+        """Add the counts of new sentences to the model, and refresh the
+        parameters that depend on them. The smoothing hyper-parameters
+        (gamma, beta) are kept unless held-out data is given to re-estimate
+        them.
+
+        sents -- list or iterable of new sentences.
+        held_out -- list of held-out sentences to re-estimate the
+            hyper-parameters on (optional).
+        """
+        count = self._count
+        orders = count.orders()
+        new_counts = count_ngrams(sents, self._n, all_ngrams=orders[0] == 1)
+        old_tables = {k: count.table(k) for k in orders}
+        count.add_counts(new_counts)
+        self._V = len(count.vocab()) - 1
+
+        # rows of the old k-grams in the new tables, and rows whose count
+        # changed (the new k-grams included)
+        positions = {}
+        changed = {}
+        for k, (ids, counts) in old_tables.items():
+            positions[k] = count.find(k, ids)
+            _, new = count.table(k)
+            changed[k] = np.ones(len(new), dtype=bool)
+            changed[k][positions[k]] = new[positions[k]] != counts
+        self._update_params(positions, changed, held_out)
+
+    def _update_params(self, positions, changed, held_out):
+        # refresh the parameters after update, given the rows of the old
+        # k-grams in the new tables and the rows whose count changed
+        pass
 
     def count(self, tokens):
         """Count for an n-gram or (n-1)-gram.
@@ -106,53 +229,45 @@ class NGram(LanguageModel):
 
         prev_tokens = prev_tokens or ()
 
-        if self.count(prev_tokens) == 0:
+        c_prev, c = self._count.count_pair(prev_tokens, token)
+        if c_prev == 0:
             return 0
-        return self.count(prev_tokens + (token,)) / self.count(prev_tokens)
+        return c / c_prev
 
-    def sent_prob(self, sent):
-        """Probability of a sentence. Warning: subject to underflow problems.
-
-        sent -- the sentence as a list of tokens.
-        """
+    def _suffix_counts(self, ngrams):
+        # counts of the contexts of the n-grams, and of the n-grams, by the
+        # length k of the context suffix (k < n)
         n = self._n
-        p = 1
-        sent = [START_TOKEN] * (n - 1) + sent + [END_TOKEN]
-        for i in range(len(sent) - n + 1):
-            token = sent[i + n - 1]
-            prev_tokens = tuple(sent[i:i + n - 1])
-            p *= self.cond_prob(token, prev_tokens)
-        return p
-
-    def sent_log_prob(self, sent):
-        """Log-probability of a sentence.
-
-        sent -- the sentence as a list of tokens.
-        """
+        counts = []
+        for k in range(n):
+            c_prev = self._count.lookup(k, ngrams[:, n - 1 - k:n - 1])
+            c = self._count.lookup(k + 1, ngrams[:, n - 1 - k:])
+            counts.append((c_prev, c))
+        return counts
+
+    def _cond_probs(self, ngrams):
+        # cond_prob of the last token of each n-gram given the others
         n = self._n
-        p = 0
-        sent = [START_TOKEN] * (n - 1) + sent + [END_TOKEN]
-        for i in range(len(sent) - n + 1):
-            token = sent[i + n - 1]
-            prev_tokens = tuple(sent[i:i + n - 1])
-            if self.cond_prob(token, prev_tokens) == 0:
-                return -math.inf
-            p += math.log(self.cond_prob(token, prev_tokens), 2)
-        return p
+        c_prev = self._count.lookup(n - 1, ngrams[:, :-1])
+        c = self._count.lookup(n, ngrams)
+        return np.divide(c, c_prev, out=np.zeros(len(c)), where=c_prev != 0)
 
 
 class AddOneNGram(NGram):
 
-    def __init__(self, n, sents):
+    def __init__(self, n, sents, store='array', workers=1):
         """
         n -- order of the model.
-        sents -- list of sentences, each one being a list of tokens.
+        sents -- list or iterable of sentences, each one being a list of
+            tokens, or their NGramCounts (see count_ngrams_external).
+        store -- count store to use, 'array' or 'trie' (default: 'array').
+        workers -- number of processes to count with (default: 1).
         """
         assert n > 0
 
         self._n = n
         self._addone = True
-        self._compute_counts(sents)
+        self._compute_counts(sents, store=store, workers=workers)
 
     def V(self):
         """Size of the vocabulary.
@@ -169,19 +284,30 @@ class AddOneNGram(NGram):
 
         prev_tokens = prev_tokens or ()
 
-        return (self.count(prev_tokens + (token,)) + 1) / \
-            (self.count(prev_tokens) + self._V)
+        c_prev, c = self._count.count_pair(prev_tokens, token)
+        return (c + 1) / (c_prev + self._V)
+
+    def _cond_probs(self, ngrams):
+        n = self._n
+        c_prev = self._count.lookup(n - 1, ngrams[:, :-1])
+        c = self._count.lookup(n, ngrams)
+        return (c + 1) / (c_prev + self._V)
 
 
 class InterpolatedNGram(NGram):
 
-    def __init__(self, n, sents, gamma=None, addone=True):
+    def __init__(self, n, sents, gamma=None, addone=True, store='array',
+                 workers=1):
         """
         n -- order of the model.
-        sents -- list of sentences, each one being a list of tokens.
+        sents -- list or iterable of sentences, each one being a list of
+            tokens (an iterable is only consumed once if gamma is given), or
+            their NGramCounts if gamma is given.
         gamma -- interpolation hyper-parameter (if not given, estimate using
             held-out data).
         addone -- whether to use addone smoothing (default: True).
+        store -- count store to use, 'array' or 'trie' (default: 'array').
+        workers -- number of processes to count with (default: 1).
         """
         assert n > 0
         self._n = n
@@ -191,12 +317,17 @@ class InterpolatedNGram(NGram):
             train_sents = sents
         else:
             # 90% training, 10% held-out
+            if isinstance(sents, NGramCounts):
+                raise ValueError('held-out data needed, the counts can not be split')
+            if not isinstance(sents, Sequence):
+                sents = list(sents)
             m = int(0.9 * len(sents))
             train_sents = sents[:m]
             held_out_sents = sents[m:]
 
         self._addone = addone
-        self._compute_counts(train_sents, all_ngrams=True)
+        self._compute_counts(train_sents, all_ngrams=True, store=store,
+                             workers=workers)
 
         # compute gamma if not given
         if gamma is not None:
@@ -205,22 +336,39 @@ class InterpolatedNGram(NGram):
             # Otherwise parameter gamma is not needed
             print('Computing gamma...')
             # use grid search to choose gamma
-            best_gamma = None
-            best_perplexity = math.inf
-            for gamma in np.linspace(GAMMA_MIN, GAMMA_MAX, GAMMA_LINSP_NUM):
-                self._gamma = gamma
-                perplexity = self.perplexity(held_out_sents)
-                if best_gamma is None or perplexity < best_perplexity:
-                    best_gamma = gamma
-                    best_perplexity = perplexity
-            self._gamma = best_gamma
+            gammas = np.linspace(GAMMA_MIN, GAMMA_MAX, GAMMA_LINSP_NUM)
+            self._gamma = self._compute_gamma(held_out_sents, gammas)
+        else:
+            self._gamma = None
+
+    def _update_params(self, positions, changed, held_out):
+        # the lambdas only depend on the counts
+        if held_out is not None and self._n > 1:
+            gammas = np.linspace(GAMMA_MIN, GAMMA_MAX, GAMMA_LINSP_NUM)
+            self._gamma = self._compute_gamma(held_out, gammas)
+
+    def _compute_gamma(self, sents, gammas):
+        # The counts of the held-out n-grams do not depend on gamma, so they
+        # are looked up once and the log-probability of the held-out data is
+        # computed for all the gammas at the same time. The best gamma has
+        # the lowest perplexity, i.e. the highest log-probability.
+        gammas = np.asarray(gammas, dtype=np.float64)
+        log_probs = np.zeros(len(gammas))
+        batch_size = max(COUNT_CHUNK_SIZE // len(gammas), 1)
+        for batch in _shards(sents, batch_size):
+            ngrams, _ = self._batch_ngrams(batch)
+            counts = self._suffix_counts(ngrams)[::-1]
+            probs = self._interpolate(counts, gammas[:, None])
+            with np.errstate(divide='ignore'):
+                log_probs += np.log2(probs).sum(axis=1)
+        return gammas[np.argmax(log_probs)]
 
     def count(self, tokens):
         """Count for an k-gram for k <= n.
 
         tokens -- the k-gram tuple.
         """
-        return self._count[tokens]
+        return self._count.get(tokens, 0)
 
     def cond_prob(self, token, prev_tokens=None):
         """Conditional probability of a token.
@@ -232,26 +380,31 @@ class InterpolatedNGram(NGram):
 
         prev_tokens = prev_tokens or ()
 
-        lambdas = self._compute_lambdas(prev_tokens)
+        # counts for prev_tokens[i:] and prev_tokens[i:] + (token,), i < n
+        suffix_counts = self._count.suffix_counts(prev_tokens, token)
+        counts = [suffix_counts[max(len(prev_tokens) - i, 0)]
+                  for i in range(self._n)]
+
+        lambdas = self._compute_lambdas([c_prev for c_prev, _ in counts])
 
         probs = []
-        for i in range(self._n):
-            if self.count(prev_tokens[i:]) != 0:
-                probs.append(self.count(prev_tokens[i:] + (token,)) /
-                             self.count(prev_tokens[i:]))
+        for c_prev, c in counts:
+            if c_prev != 0:
+                probs.append(c / c_prev)
             else:
                 probs.append(0)
 
         if self._addone:
-            probs[-1] = (self.count((token,)) + 1) / (self.count(()) + self._V)
+            c_prev, c = counts[-1]
+            probs[-1] = (c + 1) / (c_prev + self._V)
 
         return sum(l * p for l, p in zip(lambdas, probs))
 
-    def _compute_lambdas(self, prev_tokens):
+    def _compute_lambdas(self, prev_counts):
         lambdas = []
         lambda_sum = 0
         for i in range(self._n - 1):
-            c_prev = self.count(prev_tokens[i:])
+            c_prev = prev_counts[i]
             if c_prev == 0:
                 lambdas.append(0)
             else:
@@ -260,19 +413,53 @@ class InterpolatedNGram(NGram):
         lambdas.append(1 - lambda_sum)
         return lambdas
 
+    def _cond_probs(self, ngrams):
+        return self._interpolate(self._suffix_counts(ngrams)[::-1], self._gamma)
+
+    def _interpolate(self, counts, gamma):
+        # the same sums as cond_prob, given the counts from the longest
+        # context to the empty one. gamma may be an array of shape (g, 1),
+        # giving a (g, m) array of probabilities.
+        lambdas = []
+        lambda_sum = 0
+        for c_prev, _ in counts[:-1]:
+            lambdas.append(np.where(
+                c_prev == 0, 0, (1 - lambda_sum) * c_prev / (c_prev + gamma)))
+            lambda_sum = lambda_sum + lambdas[-1]
+        lambdas.append(1 - lambda_sum)
+
+        probs = [np.divide(c, c_prev, out=np.zeros(len(c)), where=c_prev != 0)
+                 for c_prev, c in counts]
+        if self._addone:
+            c_prev, c = counts[-1]
+            probs[-1] = (c + 1) / (c_prev + self._V)
+
+        result = 0
+        for l, p in zip(lambdas, probs):
+            result = result + l * p
+        return result
+
 
 class BackOffNGram(NGram):
 
-    def __init__(self, n, sents, beta=None, addone=True):
+    def __init__(self, n, sents, beta=None, addone=True, store='array',
+                 workers=1, cache_size=0):
         """
         Back-off NGram model with discounting as described by Michael Collins.
 
         n -- order of the model.
-        sents -- list of sentences, each one being a list of tokens.
+        sents -- list or iterable of sentences, each one being a list of
+            tokens (an iterable is only consumed once if beta is given), or
+            their NGramCounts if beta is given.
         beta -- discounting hyper-parameter (if not given, estimate using
             held-out data).
         addone -- whether to use addone smoothing (default: True).
+        store -- count store to use, 'array' or 'trie' (default: 'array').
+        workers -- number of processes to count with (default: 1).
+        cache_size -- number of conditional probabilities to memoize in
+            cond_prob (default: 0, no memoization). See set_cache_size.
         """
+        self.set_cache_size(cache_size)
 
         if beta is not None:
             # everything is training data
@@ -280,14 +467,20 @@ class BackOffNGram(NGram):
             self._beta = beta
         else:
             # 90% training, 10% held-out
+            if isinstance(sents, NGramCounts):
+                raise ValueError('held-out data needed, the counts can not be split')
+            if not isinstance(sents, Sequence):
+                sents = list(sents)
             m = int(0.9 * len(sents))
             train_sents = sents[:m]
             held_out_sents = sents[m:]
 
         self._n = n
         self._addone = addone
-        self._compute_counts(train_sents, all_ngrams=True)
+        self._compute_counts(train_sents, all_ngrams=True, store=store,
+                             workers=workers)
         self._compute_A()
+        self._compute_denom_stats()
 
         if beta is None:
             # Grid search to find beta
@@ -298,87 +491,559 @@ class BackOffNGram(NGram):
 
 
     def _compute_A(self):
-        self._A = a = defaultdict(set)
-        for kgram in self._count.keys():
-            if len(kgram) > 0 and kgram[-1] != START_TOKEN:
-                a[kgram[:-1]].add(kgram[-1])
+        # number of words seen after each k-gram, 0 < k < n, by order k
+        # (aligned with the rows of the count table)
+        start_id = self._count.vocab().id(START_TOKEN)
+        self._A = {}
+        for k in range(1, self._n):
+            ids, _ = self._count.table(k + 1)
+            seen = ids[:, -1] != start_id
+            parents = self._count.parents(k + 1)[seen]
+            num_kgrams = len(self._count.table(k)[1])
+            self._A[k] = np.bincount(parents, minlength=num_kgrams)
 
     def _compute_alpha(self):
         self._alpha = {}
-        for kgram, A in self._A.items():
-            len_A = len(A)
-            if len_A:
-                self._alpha[kgram] = self._beta * len_A / self.count(kgram)
-
-    def _compute_beta(self, sents):
-        print('Finding optimal beta...')
-        best_perplexity = math.inf
-        best_beta = None
-        for beta in np.linspace(BETA_MIN, BETA_MAX, BETA_LINSP_NUM):
-            self._beta = beta
+        for k, len_A in self._A.items():
+            _, counts = self._count.table(k)
+            alpha = np.ones(len(counts))
+            seen = len_A > 0
+            alpha[seen] = self._beta * len_A[seen] / counts[seen]
+            self._alpha[k] = alpha
+
+    def _update_params(self, positions, changed, held_out):
+        # Only the rows that may change are recomputed:
+        #   - |A(h)| grows by the number of new successors of h.
+        #   - alpha(h) changes with |A(h)| or c(h), so only if c(h) changes.
+        #   - d0(h) and d1(h) depend on c(h[1:]) and the counts of its
+        #     successors, so they change only if c(h[1:]) changes. For
+        #     k = 1 they depend on the total count, and change everywhere.
+        # A new beta changes alpha and the denominators everywhere.
+        start_id = self._count.vocab().id(START_TOKEN)
+        old_beta = self._beta
+        old_alpha = self._alpha
+        old_denoms = self._denoms
+        for k in range(1, self._n):
+            size = len(changed[k])
+            ids, _ = self._count.table(k + 1)
+            new_rows = np.ones(len(ids), dtype=bool)
+            new_rows[positions[k + 1]] = False
+            new_rows &= ids[:, -1] != start_id
+            parents = self._count.parents(k + 1)[new_rows]
+            self._A[k] = _reindex(self._A[k], positions[k], size) + \
+                np.bincount(parents, minlength=size)
+
+        stale = {}
+        for k in range(1, self._n):
+            size = len(changed[k])
+            if k == 1:
+                stale[k] = np.ones(size, dtype=bool)
+            else:
+                kgrams, _ = self._count.table(k)
+                stale[k] = changed[k - 1][self._count.find(k - 1, kgrams[:, 1:])]
+            d0, d1 = self._denom_stats[k]
+            d0 = _reindex(d0, positions[k], size)
+            d1 = _reindex(d1, positions[k], size)
+            d0[stale[k]], d1[stale[k]] = self._kgram_denom_stats(k, stale[k])
+            self._denom_stats[k] = (d0, d1)
+
+        if held_out is not None:
+            self._compute_beta(held_out)
+
+        if self._beta != old_beta:
             self._compute_denoms()
             self._compute_alpha()
+            return
 
-            perplexity = self.perplexity(sents)
-            if best_beta == None or best_perplexity > perplexity:
-                best_beta = self._beta
-                best_perplexity = perplexity
-        self._beta = best_beta
+        self._denoms = {}
+        self._alpha = {}
+        for k in range(1, self._n):
+            size = len(changed[k])
+            d0, d1 = self._denom_stats[k]
+            denoms = _reindex(old_denoms[k], positions[k], size)
+            denoms[stale[k]] = d0[stale[k]] + d1[stale[k]] * self._beta
+            self._denoms[k] = denoms
+
+            _, counts = self._count.table(k)
+            alpha = _reindex(old_alpha[k], positions[k], size)
+            len_A = self._A[k]
+            rows = changed[k]
+            alpha[rows] = np.where(len_A[rows] > 0,
+                                   self._beta * len_A[rows] / counts[rows], 1)
+            self._alpha[k] = alpha
+
+    def _compute_beta(self, sents):
+        # The counts of the held-out n-grams and of their contexts do not
+        # depend on beta, so they are looked up once and the log-probability
+        # of the held-out data is computed for all the betas at the same
+        # time. The best beta has the lowest perplexity, i.e. the highest
+        # log-probability.
+        print('Finding optimal beta...')
+        betas = np.linspace(BETA_MIN, BETA_MAX, BETA_LINSP_NUM)
+        log_probs = np.zeros(len(betas))
+        batch_size = max(COUNT_CHUNK_SIZE // len(betas), 1)
+        for batch in _shards(sents, batch_size):
+            ngrams, _ = self._batch_ngrams(batch)
+            probs = self._backoff_probs(self._suffix_counts(ngrams),
+                                        self._context_stats(ngrams),
+                                        betas[:, None])
+            with np.errstate(divide='ignore'):
+                # probs do not depend on beta if n = 1
+                log_probs += np.log2(probs).sum(axis=-1)
+        self._beta = betas[np.argmax(log_probs)]
+
+    def _compute_denom_stats(self):
+        # For a k-gram h, denom(h) = 1 - sum of P(t | h[1:]) for t in A(h).
+        # As h t is seen, so is h[1:] t, and if k > 1
+        #   P(t | h[1:]) = (c(h[1:] t) - beta) / c(h[1:])
+        # so denom(h) = d0 + d1 * beta with
+        #   d0 = 1 - sum of c(h[1:] t) / c(h[1:]),  d1 = |A(h)| / c(h[1:]).
+        # If k = 1 the probabilities are unigram ones and d1 = 0.
+        self._denom_stats = {k: self._kgram_denom_stats(k)
+                             for k in range(1, self._n)}
+
+    def _kgram_denom_stats(self, k, rows=None):
+        # d0 and d1 of the k-grams, or of those selected by the boolean mask
+        # rows
+        start_id = self._count.vocab().id(START_TOKEN)
+        ids, _ = self._count.table(k + 1)
+        seen = ids[:, -1] != start_id
+        parents = self._count.parents(k + 1)
+        kgrams, _ = self._count.table(k)
+        if rows is None:
+            rows = np.ones(len(kgrams), dtype=bool)
+        seen &= rows[parents]
+        parents = parents[seen]
+        if k == 1:
+            c = self._count.lookup(1, ids[seen][:, 1:])
+            c_prev = self._count.lookup(0, c)
+            if self._addone:
+                probs = (c + 1) / (c_prev + self._V)
+            else:
+                probs = c / c_prev
+            d0 = 1 - np.bincount(parents, weights=probs, minlength=len(kgrams))
+            d1 = np.zeros(len(kgrams))
+            return d0[rows], d1[rows]
+        c = self._count.lookup(k, ids[seen][:, 1:])
+        c_sum = np.bincount(parents, weights=c, minlength=len(kgrams))[rows]
+        c_prev = self._count.lookup(k - 1, kgrams[rows][:, 1:])
+        nonzero = c_prev != 0
+        d0 = 1 - np.divide(c_sum, c_prev, out=np.zeros(len(c_sum)),
+                           where=nonzero)
+        d1 = np.divide(self._A[k][rows], c_prev, out=np.zeros(len(c_sum)),
+                       where=nonzero)
+        return d0, d1
 
     def _compute_denoms(self):
-        self._denoms = defaultdict(float)
         # Normalization factors for every k-gram 0 < k < n
-        for kgram in self._count.keys():
-            if len(kgram) == 0 or len(kgram) == self._n:
-                continue
-
-            probs = [self.cond_prob(token, kgram[1:])
-                     for token in self.A(kgram)]
-            self._denoms[kgram] = 1 - sum(probs)
+        self._denoms = {k: d0 + d1 * self._beta
+                        for k, (d0, d1) in self._denom_stats.items()}
 
     def A(self, tokens):
         """Set of words with counts > 0 for a k-gram with 0 < k < n.
 
         tokens -- the k-gram tuple.
         """
-        return self._A[tokens]
+        vocab = self._count.vocab()
+        ids, _ = self._count.successors(vocab.ids(tokens))
+        return {vocab.token(i) for i in ids.tolist()} - {START_TOKEN}
 
     def alpha(self, kgram):
         """Missing probability mass for a k-gram with 0 < k < n.
 
         tokens -- the k-gram tuple.
         """
-        return self._alpha.get(kgram, 1)
+        return self._kgram_param(self._alpha, kgram)
 
     def denom(self, kgram):
-        return self._denoms.get(kgram, 1)
+        return self._kgram_param(self._denoms, kgram)
+
+    def _kgram_param(self, param, kgram):
+        # value of a per k-gram parameter (default 1 for unseen k-grams)
+        values = param.get(len(kgram))
+        if values is None:
+            return 1
+        row = self._count.row(self._count.vocab().ids(kgram))
+        return 1 if row < 0 else values[row]
+
+    def set_cache_size(self, cache_size):
+        """Set the number of conditional probabilities memoized by cond_prob,
+        for the context and each of its suffixes, dropping the least recently
+        used ones. The memoized values are dropped whenever beta, alpha, the
+        denominators or the counts are replaced.
+
+        cache_size -- the maximum number of values (0 to disable).
+        """
+        self._cache_size = cache_size
+        self._cache = None
+        self._cache_params = None
+
+    def cache_info(self):
+        """Dict with the hits, misses, size and maximum size of the cache of
+        cond_prob (None if disabled).
+        """
+        cache = self._get_cache()
+        return None if cache is None else cache.info()
+
+    def _get_cache(self):
+        if not self._cache_size:
+            return None
+        if self._cache is None:
+            self._cache = LRUCache(self._cache_size)
+        # the parameters are replaced, not modified, when they change
+        params = (getattr(self, '_beta', None), getattr(self, '_alpha', None),
+                  getattr(self, '_denoms', None), self._count)
+        old = self._cache_params
+        if old is None or old[0] != params[0] or \
+                any(a is not b for a, b in zip(old[1:], params[1:])):
+            self._cache.clear()
+            self._cache_params = params
+        return self._cache
 
     def cond_prob(self, token, prev_tokens=None):
-        if prev_tokens == () or prev_tokens is None:
+        prev_tokens = tuple(prev_tokens or ())
+        cache = self._get_cache()
+        if cache is not None:
+            p = cache.get((token, prev_tokens))
+            if p is not None:
+                return p
+        # counts for every suffix of prev_tokens, shared by all the back-offs
+        suffix_counts = self._count.suffix_counts(prev_tokens, token)
+        p = self._backoff_prob(token, prev_tokens, suffix_counts, cache)
+        if cache is not None:
+            cache[token, prev_tokens] = p
+        return p
+
+    def _backoff_prob(self, token, prev_tokens, suffix_counts, cache=None):
+        c_prev, c = suffix_counts[len(prev_tokens)]
+        if prev_tokens == ():
             if self._addone:
-                return (self.count((token,)) + 1) / (self.count(()) + self._V)
+                return (c + 1) / (c_prev + self._V)
             else:
-                return self.count((token,)) / self.count(())
+                return c / c_prev
 
-        if self.count(prev_tokens + (token,)):
-            p = (self.count(prev_tokens + (token,)) - self._beta) / \
-                self.count(prev_tokens)
+        if c:
+            p = (c - self._beta) / c_prev
         else:
             alpha = self.alpha(prev_tokens)
             if not alpha:
                 p = 0
             else:
                 denom = self.denom(prev_tokens)
-                p = self.alpha(prev_tokens) * \
-                    self.cond_prob(token, prev_tokens[1:]) / denom
+                key = (token, prev_tokens[1:])
+                lower_p = None if cache is None else cache.get(key)
+                if lower_p is None:
+                    lower_p = self._backoff_prob(token, prev_tokens[1:],
+                                                 suffix_counts, cache)
+                    if cache is not None:
+                        cache[key] = lower_p
+                p = alpha * lower_p / denom
 
         return p
 
+    def __getstate__(self):
+        # the cache is rebuilt when needed
+        state = self.__dict__.copy()
+        state['_cache'] = None
+        state['_cache_params'] = None
+        return state
+
+    def _cond_probs(self, ngrams):
+        return self._backoff_probs(self._suffix_counts(ngrams),
+                                   self._context_stats(ngrams), self._beta)
+
+    def _context_stats(self, ngrams):
+        # |A|, d0 and d1 of the contexts of the n-grams, by length k > 0
+        # (those of unseen contexts give alpha = denom = 1)
+        n = self._n
+        stats = {}
+        for k in range(1, n):
+            rows = self._count.find(k, ngrams[:, n - 1 - k:n - 1])
+            found = rows >= 0
+            d0, d1 = self._denom_stats[k]
+            stats[k] = (np.where(found, self._A[k][rows], 0),
+                        np.where(found, d0[rows], 1),
+                        np.where(found, d1[rows], 0))
+        return stats
+
+    def _backoff_probs(self, counts, stats, beta):
+        # _backoff_prob from the empty context up to the full one. beta may
+        # be an array of shape (g, 1), giving a (g, m) array of probabilities.
+        c_prev, c = counts[0]
+        if self._addone:
+            probs = (c + 1) / (c_prev + self._V)
+        else:
+            probs = c / c_prev
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for k in range(1, self._n):
+                c_prev, c = counts[k]
+                len_A, d0, d1 = stats[k]
+                alpha = np.where(len_A > 0, beta * len_A / c_prev, 1)
+                denom = d0 + d1 * beta
+                backoff = np.where(alpha == 0, 0, alpha * probs / denom)
+                probs = np.where(c > 0, (c - beta) / c_prev, backoff)
+        return probs
+
+
+class KneserNeyNGram(NGram):
+
+    def __init__(self, n, sents, store='array', workers=1):
+        """
+        Interpolated modified Kneser-Ney model, as described by Chen and
+        Goodman.
+
+        n -- order of the model.
+        sents -- list or iterable of sentences, each one being a list of
+            tokens, or their NGramCounts (with all the k-grams).
+        store -- count store to use, 'array' or 'trie' (default: 'array').
+        workers -- number of processes to count with (default: 1).
+        """
+        assert n > 0
+        self._n = n
+        self._addone = False
+
+        self._compute_counts(sents, all_ngrams=True, store=store,
+                             workers=workers)
+        self._compute_kn_counts()
+
+    def _compute_kn_counts(self):
+        # For each order k, aligned with the rows of the count tables:
+        #   _discounted[k]: discounted count of each k-gram.
+        #   _totals[k - 1]: sum of the counts of the successors of each
+        #     (k - 1)-gram (for k = 1, of the empty context).
+        #   _backoff_mass[k - 1]: sum of the discounts of those successors,
+        #     the mass given to the lower order.
+        # The counts are the raw ones for n-grams and for k-grams starting
+        # with START_TOKEN, and continuation counts (the number of distinct
+        # tokens seen before the k-gram) for the other k-grams.
+        start_id = self._count.vocab().id(START_TOKEN)
+        self._discounts = {}
+        self._discounted = {}
+        self._totals = {}
+        self._backoff_mass = {}
+        for k in range(1, self._n + 1):
+            ids, counts = self._count.table(k)
+            if k < self._n:
+                ext_ids, _ = self._count.table(k + 1)
+                suffixes = self._count.find(k, ext_ids[:, 1:])
+                cont_counts = np.bincount(suffixes, minlength=len(counts))
+                counts = np.where(ids[:, 0] == start_id, counts, cont_counts)
+            # START_TOKEN is never predicted
+            counts = np.where(ids[:, -1] == start_id, 0, counts)
+
+            discounts = self._compute_discounts(counts)
+            discount = discounts[np.minimum(counts, 3)]
+            self._discounts[k] = discounts
+            self._discounted[k] = np.maximum(counts - discount, 0)
+
+            parents = self._count.parents(k)
+            num_contexts = 1 if k == 1 else len(self._count.table(k - 1)[1])
+            self._totals[k - 1] = np.bincount(parents, weights=counts,
+                                              minlength=num_contexts)
+            self._backoff_mass[k - 1] = np.bincount(parents, weights=discount,
+                                                    minlength=num_contexts)
+
+    def _update_params(self, positions, changed, held_out):
+        # the discounts depend on the counts of counts of every order
+        self._compute_kn_counts()
+
+    def _compute_discounts(self, counts):
+        # discounts for counts 0, 1, 2 and 3 or more, from the counts of
+        # counts
+        n1, n2, n3, n4 = [np.count_nonzero(counts == i) for i in range(1, 5)]
+        if min(n1, n2, n3, n4) == 0:
+            # too few k-grams to estimate them
+            return np.array([0] + KN_DISCOUNTS, dtype=np.float64)
+        y = n1 / (n1 + 2 * n2)
+        discounts = np.array([0, 1 - 2 * y * n2 / n1, 2 - 3 * y * n3 / n2,
+                              3 - 4 * y * n4 / n3])
+        return np.clip(discounts, 0, [0, 1, 2, 3])
+
+    def cond_prob(self, token, prev_tokens=None):
+        """Conditional probability of a token.
+
+        token -- the token.
+        prev_tokens -- the previous n-1 tokens (optional only if n = 1).
+        """
+        assert (prev_tokens is not None) or self._n == 1
+
+        prev_tokens = tuple(prev_tokens or ())
+        ids = self._count.vocab().ids(prev_tokens + (token,))
+        return float(self._cond_probs(np.array([ids], dtype=np.uint32))[0])
+
+    def _cond_probs(self, ngrams):
+        # From the unigrams up to the k-grams of the width of ngrams, which
+        # may be less than n for the lower order distributions. The
+        # unigrams give the mass left to the uniform distribution.
+        width = ngrams.shape[1]
+        rows = self._count.find(1, ngrams[:, -1:])
+        discounted = np.where(rows >= 0, self._discounted[1][rows], 0)
+        probs = (discounted + self._backoff_mass[0][0] / self._V) / self._totals[0][0]
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for k in range(2, width + 1):
+                rows = self._count.find(k, ngrams[:, width - k:])
+                discounted = np.where(rows >= 0, self._discounted[k][rows], 0)
+                contexts = self._count.find(k - 1, ngrams[:, width - k:-1])
+                found = contexts >= 0
+                total = np.where(found, self._totals[k - 1][contexts], 0)
+                mass = np.where(found, self._backoff_mass[k - 1][contexts], 0)
+                probs = np.where(total > 0, (discounted + mass * probs) / total,
+                                 probs)
+        return probs
+
+
+def evaluate_models(models, sents, batch_size=COUNT_CHUNK_SIZE, workers=1):
+    """Evaluate several models on the same sentences in one pass, see
+    NGram.evaluate.
+
+    The sentences are read once, and converted to ids once for all the
+    models with the same vocabulary: the n-grams of the lower order models
+    are the last columns of the highest order ones.
+
+    Returns a list with the result dict of each model, with the seconds
+    spent scoring as 'time'.
+
+    models -- the models.
+    sents -- list or iterable of sentences.
+    batch_size -- number of tokens to score at a time.
+    workers -- number of threads scoring the models of a batch.
+    """
+    # models grouped by vocabulary
+    groups = []
+    for i, model in enumerate(models):
+        tokens = model.vocab().tokens()
+        for group_tokens, group in groups:
+            if group_tokens == tokens:
+                group.append(i)
+                break
+        else:
+            groups.append((tokens, [i]))
+
+    stats = [_EvalStats() for _ in models]
+    times = [0.0] * len(models)
+
+    def score(i, ngrams, lengths):
+        start = time.perf_counter()
+        stats[i].add(models[i], ngrams[:, ngrams.shape[1] - models[i]._n:],
+                     lengths)
+        times[i] += time.perf_counter() - start
+
+    with ThreadPoolExecutor(workers) as pool:
+        for batch in _shards(sents, batch_size):
+            for _, group in groups:
+                n = max(models[i]._n for i in group)
+                ngrams, lengths = _batch_ngrams(models[group[0]].vocab(), n,
+                                                batch)
+                list(pool.map(lambda i: score(i, ngrams, lengths), group))
+
+    results = [s.result() for s in stats]
+    for result, t in zip(results, times):
+        result['time'] = t
+    return results
+
+
+def _reindex(values, positions, size):
+    # values of the old rows of a table moved to their new positions, with
+    # zeros in the new rows
+    result = np.zeros(size, dtype=values.dtype)
+    result[positions] = values
+    return result
+
+
+def _batch_ngrams(vocab, n, sents):
+    # ids of the n-grams of the padded sentences, as a (m, n) array, and
+    # the number of n-grams of each sentence (its tokens and END_TOKEN)
+    pad = [vocab.id(START_TOKEN)] * (n - 1)
+    end_id = vocab.id(END_TOKEN)
+    ids = []
+    lengths = []
+    for sent in sents:
+        ids += pad
+        ids += vocab.ids(sent)
+        ids.append(end_id)
+        lengths.append(len(sent) + 1)
+    ids = np.array(ids, dtype=np.uint32)
+    lengths = np.array(lengths, dtype=np.int64)
+    if len(lengths) == 0:
+        return np.empty((0, n), dtype=np.uint32), lengths
+
+    # an n-gram ends at every position that is not padding
+    real = np.ones(len(ids), dtype=bool)
+    if n > 1:
+        starts = np.cumsum(lengths + n - 1) - (lengths + n - 1)
+        real[(starts[:, None] + np.arange(n - 1)).reshape(-1)] = False
+    return sliding_window_view(ids, n)[real[n - 1:]], lengths
+
+
+class _EvalStats(object):
+    # totals of NGram.evaluate, added up batch by batch
+
+    def __init__(self):
+        self.log_prob = 0
+        self.num_sents = self.num_tokens = self.num_oov = 0
+        self.zero_probs = self.zero_prob_sents = 0
+
+    def add(self, model, ngrams, lengths):
+        # score a batch, returning the log-probability of each sentence
+        probs = model._cond_probs(ngrams)
+        scores = model._sent_log_probs(probs, lengths)
+        self.log_prob += float(scores.sum())
+        self.num_sents += len(lengths)
+        self.num_tokens += int(lengths.sum())
+        self.num_oov += int(np.count_nonzero(ngrams[:, -1] == UNK_ID))
+        self.zero_probs += int(np.count_nonzero(probs == 0))
+        self.zero_prob_sents += int(np.count_nonzero(scores == -math.inf))
+        return scores
+
+    def result(self):
+        # with no tokens there is nothing to average over
+        if self.num_tokens:
+            cross_entropy = - self.log_prob / self.num_tokens
+        else:
+            cross_entropy = math.nan
+        return {
+            'log_prob': self.log_prob,
+            'cross_entropy': cross_entropy,
+            'perplexity': 2 ** cross_entropy,
+            'num_sents': self.num_sents,
+            'num_tokens': self.num_tokens,
+            # END_TOKENs are not part of the text
+            'oov_rate': self.num_oov / (self.num_tokens - self.num_sents or 1),
+            'zero_probs': self.zero_probs,
+            'zero_prob_sents': self.zero_prob_sents,
+        }
+
 
 class SentSorter():
 
-    def __init__(self, model):
+    def __init__(self, model, beam_width=1, cache_size=None, exact=False,
+                 exact_max_len=SORT_EXACT_MAX_LEN):
+        """
+        Orders the tokens of sentences by beam search over the model's
+        log-probabilities. With beam_width = 1 it is a greedy search.
+
+        With exact and a bigram model, the sentences of up to exact_max_len
+        tokens get their most probable order, found with the Held-Karp
+        algorithm (the longer ones are left to the beam search).
+
+        model -- n-gram model.
+        beam_width -- number of partial orderings kept at each step.
+        cache_size -- maximum number of (context, token) log-probabilities
+            kept between sentences (default: no limit).
+        exact -- whether to sort exactly with bigram models.
+        exact_max_len -- longest sentence to sort exactly.
+        """
+        assert beam_width > 0
         self.model = model
+        self._beam_width = beam_width
+        self._exact = exact and model._n == 2
+        self._exact_max_len = exact_max_len
+        if cache_size is None:
+            self._scores = {}
+        else:
+            self._scores = LRUCache(cache_size)
 
     def get_most_probable_token(self, possible_tokens, prev_tokens):
         best_p = 0
@@ -395,17 +1060,107 @@ class SentSorter():
         """ Get the most probable sentences out of the shuffled ones
             according to the model probabilities. """
 
+        return [self.sort_sent(sent) for sent in shuffled_sents]
+
+    def sort_sent(self, sent):
+        """Most probable order of the tokens of a sentence found by the beam
+        search, END_TOKEN included in the score.
+
+        sent -- the sentence as a list of tokens.
+        """
+        if self._exact and len(sent) <= self._exact_max_len:
+            return self._sort_exact(sent)
+
         n = self.model._n
-        sorted_sents = []
-        for s in shuffled_sents:
-            sent = s.copy()
-
-            new_sent = ['<s>'] * (n - 1)
-            while sent:
-                next_tok = self.get_most_probable_token(sent, tuple(new_sent[-n + 1:]))
-                new_sent += [next_tok]
-                sent.remove(next_tok)
-            new_sent = new_sent[n - 1:]
-            sorted_sents.append(new_sent)
-
-        return sorted_sents
+        vocab = self.model.vocab()
+        # a hypothesis is (log-probability, context ids, tokens left of each
+        # distinct token, indices of the distinct tokens placed so far)
+        tokens = list(dict.fromkeys(sent))
+        ids = vocab.ids(tokens)
+        left = tuple(sent.count(token) for token in tokens)
+        beam = [(0.0, (vocab.id(START_TOKEN),) * (n - 1), left, ())]
+
+        for _ in range(len(sent)):
+            steps = [(hyp, j) for hyp in beam
+                     for j, c in enumerate(hyp[2]) if c > 0]
+            scores = self._log_probs([(hyp[1], ids[j]) for hyp, j in steps])
+            # hypotheses with the same context and tokens left can only be
+            # extended in the same ways, so only the best one is kept
+            best = {}
+            for ((score, context, left, placed), j), lp in zip(steps, scores):
+                context = (context + (ids[j],))[1:] if n > 1 else ()
+                left = left[:j] + (left[j] - 1,) + left[j + 1:]
+                hyp = best.get((context, left))
+                if hyp is None or score + lp > hyp[0]:
+                    best[context, left] = (score + lp, context, left,
+                                           placed + (j,))
+            beam = sorted(best.values(), key=lambda hyp: -hyp[0])
+            beam = beam[:self._beam_width]
+
+        end_id = vocab.id(END_TOKEN)
+        scores = self._log_probs([(hyp[1], end_id) for hyp in beam])
+        i = max(range(len(beam)), key=lambda i: beam[i][0] + scores[i])
+        return [tokens[j] for j in beam[i][3]]
+
+    def _sort_exact(self, sent):
+        # Held-Karp over the bigram transitions: best[S, j] is the score of
+        # the best ordering of the tokens in the set S (a bit mask of their
+        # positions) that ends with token j. The sets are extended one
+        # token at a time, all the sets of the same size at once.
+        L = len(sent)
+        if L == 0:
+            return []
+        vocab = self.model.vocab()
+        ids = vocab.ids(sent)
+        prev_ids = [vocab.id(START_TOKEN)] + ids
+        next_ids = ids + [vocab.id(END_TOKEN)]
+        ngrams = np.array([(a, b) for a in prev_ids for b in next_ids],
+                          dtype=np.uint32)
+        with np.errstate(divide='ignore'):
+            scores = np.log2(self.model._cond_probs(ngrams))
+        scores = np.maximum(scores, SORT_LOG_ZERO).reshape(L + 1, L + 1)
+        start, trans, end = scores[0, :L], scores[1:, :L], scores[1:, L]
+
+        sets = np.arange(1 << L)
+        sizes = np.zeros(1 << L, dtype=np.int64)
+        for j in range(L):
+            sizes += (sets >> j) & 1
+        best = np.full((1 << L, L), -np.inf)
+        back = np.zeros((1 << L, L), dtype=np.int64)
+        best[1 << np.arange(L), np.arange(L)] = start
+        for size in range(2, L + 1):
+            layer = sets[sizes == size]
+            for j in range(L):
+                S = layer[(layer >> j) & 1 == 1]
+                prev = best[S ^ (1 << j)] + trans[:, j]
+                back[S, j] = prev.argmax(axis=1)
+                best[S, j] = prev[np.arange(len(S)), back[S, j]]
+
+        full = (1 << L) - 1
+        j = int((best[full] + end).argmax())
+        order = []
+        S = full
+        for _ in range(L):
+            order.append(j)
+            S, j = S ^ (1 << j), int(back[S, j])
+        return [sent[j] for j in reversed(order)]
+
+    def _log_probs(self, pairs):
+        # log-probabilities of (context ids, token id) pairs, scoring the
+        # ones missing from the cache in one batch
+        found = {}
+        missing = []
+        for pair in set(pairs):
+            lp = self._scores.get(pair)
+            if lp is None:
+                missing.append(pair)
+            else:
+                found[pair] = lp
+        if missing:
+            ngrams = np.array([context + (token,) for context, token in missing],
+                              dtype=np.uint32).reshape(len(missing), -1)
+            with np.errstate(divide='ignore'):
+                log_probs = np.log2(self.model._cond_probs(ngrams))
+            for pair, lp in zip(missing, log_probs.tolist()):
+                found[pair] = self._scores[pair] = lp
+        return [found[pair] for pair in pairs]
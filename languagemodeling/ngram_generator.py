@@ -1,46 +1,129 @@
-from collections import defaultdict
+from bisect import bisect_left
+from itertools import accumulate
+from multiprocessing import Pool
 import random
 
-from languagemodeling.consts import START_TOKEN, END_TOKEN
+import numpy as np
+
+from languagemodeling.cache import LRUCache
+from languagemodeling.consts import START_TOKEN, END_TOKEN, \
+    GENERATE_STREAM_SIZE
+from languagemodeling.counts import ID_DTYPE, pack_keys
+from languagemodeling.ngram import NGram
 
 
 class NGramGenerator(object):
 
-    def __init__(self, model):
+    def __init__(self, model, cache_size=None, top_k=None, top_p=None):
         """
-        model -- n-gram model.
+        The distribution of each context is computed the first time it is
+        sampled, and kept for the next ones.
+
+        With top_k or top_p the tokens are sampled only from the most
+        probable ones of each context, in proportion to their probabilities.
+
+        model -- n-gram model with counts (not a compiled one).
+        cache_size -- maximum number of context distributions to keep, the
+            least recently used ones are dropped (default: no limit).
+        top_k -- number of most probable tokens to sample from.
+        top_p -- sample from the fewest most probable tokens whose
+            probabilities add up to this fraction of the context's total
+            (nucleus sampling, 0 < top_p <= 1).
         """
+        if not isinstance(model, NGram):
+            raise TypeError('can not generate from a {}, it keeps no counts'.format(
+                type(model).__name__))
+        assert top_k is None or top_k > 0
+        assert top_p is None or 0.0 < top_p <= 1.0
         self._n = model._n
+        self._top_k = top_k
+        self._top_p = top_p
+        self._model = model
+        self._count = model._count
+        self._tokens = model._count.vocab().tokens()
+        self._cache_size = cache_size
+        if cache_size is None:
+            self._cache = {}
+        else:
+            self._cache = LRUCache(cache_size)
+        # alias tables for generate_sents
+        self._flat = _FlatTables()
+
+    @property
+    def _probs(self):
+        """Dict with the probabilities of the seen n-grams, by context."""
+        return {prev_tokens: dict(probs)
+                for prev_tokens, probs in self._sorted_probs.items()}
+
+    @property
+    def _sorted_probs(self):
+        """Dict with the (token, probability) pairs of the seen n-grams, in
+        descending order of probability, by context.
+        """
+        ids, _ = self._count.table(self._n)
+        contexts = sorted({tuple(self._tokens[i] for i in row)
+                           for row in ids[:, :-1].tolist()})
+        return {prev_tokens: self._distribution(prev_tokens)[0]
+                for prev_tokens in contexts}
+
+    def _distribution(self, prev_tokens):
+        """Distribution of the tokens seen after prev_tokens (None if the
+        context was never seen).
+
+        Returns the (token, probability) pairs in descending order of
+        probability, their cumulative probabilities and an alias table to
+        sample from them (from the most probable ones with top_k or top_p).
+
+        prev_tokens -- the previous n-1 tokens.
+        """
+        dist = self._cache.get(prev_tokens)
+        if dist is not None:
+            return dist
 
-        # compute the probabilities
-        probs = defaultdict(dict)
+        ids = self._count.vocab().ids(prev_tokens)
+        succ, _ = self._count.successors(ids)
+        if len(succ) == 0:
+            return None
+        ngrams = np.empty((len(succ), self._n), dtype=np.uint32)
+        ngrams[:, :-1] = ids
+        ngrams[:, -1] = succ
+        tokens = self._tokens
+        probs = sorted(zip([tokens[i] for i in succ.tolist()],
+                           self._model._cond_probs(ngrams).tolist()),
+                       key=lambda item: (-item[1], item[0]))
+        # smoothed models leave some mass to unseen n-grams, so the samples
+        # are drawn from the seen ones in proportion to their probabilities
+        cum_probs = list(accumulate(value for _, value in probs))
+        size = self._truncation(cum_probs)
 
-        for ngram in model._count.keys():
-            if len(ngram) == self._n:
-               probs[ngram[:-1]][ngram[-1]] = model.cond_prob(ngram[-1], ngram[:-1])
-        self._probs = dict(probs)
+        dist = probs, cum_probs, alias_table(probs[:size], cum_probs[size - 1])
+        self._cache[prev_tokens] = dist
+        return dist
 
-        # sort in descending order for efficient sampling
-        self._sorted_probs = sorted_probs = {}
-        for ngram, probs in self._probs.items():
-            sorted_probs[ngram] = []
-            for key, value in sorted(probs.items(), key=lambda item: (-item[1], item[0])):
-                sorted_probs[ngram].append((key, value))
-        self._sorted_probs = sorted_probs
+    def _truncation(self, cum_probs):
+        # number of most probable tokens to sample from
+        size = len(cum_probs)
+        if self._top_k is not None:
+            size = min(size, self._top_k)
+        if self._top_p is not None:
+            mass = self._top_p * cum_probs[-1]
+            size = min(size, bisect_left(cum_probs, mass) + 1)
+        return size
+
+    def _sample(self, prev_tokens):
+        # constant time draw from the alias table
+        tokens, keep, alias = self._distribution(prev_tokens)[2]
+        i = int(random.random() * len(tokens))
+        if random.random() < keep[i]:
+            return tokens[i]
+        return tokens[alias[i]]
 
     def generate_sent(self):
         """Randomly generate a sentence."""
         sent = [START_TOKEN] * (self._n - 1)
         while END_TOKEN not in sent:
-            u = random.random()
             last_ngram = tuple(sent[len(sent) - self._n + 1:])
-            probs = self._sorted_probs[last_ngram]
-            i = 0
-            acum_prob = probs[i][1]
-            while acum_prob < u:
-                i += 1
-                acum_prob += probs[i][1]
-            sent += [probs[i][0]]
+            sent.append(self._sample(last_ngram))
 
         return sent[self._n - 1:-1]
 
@@ -52,14 +135,173 @@ class NGramGenerator(object):
         """
         assert((prev_tokens is not None) or self._n == 1)
 
-        if prev_tokens not in self._sorted_probs.keys():
+        if prev_tokens is None:
+            prev_tokens = ()
+        if self._distribution(prev_tokens) is None:
             return ''
 
-        u = random.random()
-        i = 0
-        probs = self._sorted_probs[prev_tokens]
-        acum_prob = probs[i][1]
-        while acum_prob < u:
-            i += 1
-            acum_prob += probs[i][1]
-        return probs[i][0]
+        return self._sample(prev_tokens)
+
+    def generate_sents(self, num, seed=None, workers=1,
+                       stream_size=GENERATE_STREAM_SIZE):
+        """Iterator over randomly generated sentences.
+
+        The sentences are generated in streams of stream_size sentences that
+        advance in lockstep, each one with its own numpy generator seeded
+        from seed, so the output only depends on seed and stream_size (not
+        on the number of workers).
+
+        num -- number of sentences.
+        seed -- seed of the random streams (default: a fresh one).
+        workers -- number of processes to generate with (default: 1).
+        stream_size -- number of sentences of each stream.
+        """
+        sizes = [min(stream_size, num - i) for i in range(0, num, stream_size)]
+        seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+        streams = zip(sizes, seeds)
+        if workers == 1:
+            for size, stream_seed in streams:
+                yield from self._generate_stream(size, stream_seed)
+        else:
+            with Pool(workers, _init_worker, (self,)) as pool:
+                for sents in pool.imap(_generate_stream, streams):
+                    yield from sents
+
+    def _generate_stream(self, num, seed):
+        # All the sentences of the stream are extended by one token at each
+        # step, sampling them at once from the flat alias tables.
+        rng = np.random.default_rng(seed)
+        vocab = self._count.vocab()
+        end_id = vocab.id(END_TOKEN)
+        flat = self._flat
+        if self._cache_size is not None and len(flat) > self._cache_size:
+            flat = self._flat = _FlatTables()
+
+        active = np.arange(num)
+        contexts = np.full((num, self._n - 1), vocab.id(START_TOKEN),
+                           dtype=np.uint32)
+        steps = [(active[:0], contexts[:0, -1:].reshape(-1))]
+        while len(active):
+            # flat table positions of the contexts, adding the new ones
+            if self._n > 1:
+                keys, inverse = np.unique(pack_keys(contexts),
+                                          return_inverse=True)
+                keys = keys.tolist()
+                inverse = inverse.reshape(-1)
+            else:
+                keys, inverse = [b''], np.zeros(len(active), dtype=np.int64)
+            starts, sizes = flat.positions(keys, self._context_table)
+
+            # alias sampling, with the columns offset to each context's table
+            start = starts[inverse]
+            cols = rng.random(len(active)) * sizes[inverse]
+            cols = start + cols.astype(np.int64)
+            picked = np.where(rng.random(len(active)) < flat.keep[cols],
+                              cols, start + flat.alias[cols])
+            next_ids = flat.ids[picked]
+
+            going = next_ids != end_id
+            active = active[going]
+            steps.append((active, next_ids[going]))
+            contexts = contexts[going]
+            if self._n > 1:
+                contexts = np.concatenate(
+                    [contexts[:, 1:], next_ids[going, None]], axis=1)
+
+        # tokens of each sentence, in the order they were generated
+        rows = np.concatenate([rows for rows, _ in steps])
+        ids = np.concatenate([ids for _, ids in steps])
+        order = np.argsort(rows, kind='stable')
+        ends = np.cumsum(np.bincount(rows, minlength=num)).tolist()
+        tokens = [self._tokens[i] for i in ids[order].tolist()]
+        return [tokens[i:j] for i, j in zip([0] + ends[:-1], ends)]
+
+    def _context_table(self, key):
+        # alias table of a packed context as arrays, with token ids
+        row = np.frombuffer(key, dtype=ID_DTYPE)
+        prev_tokens = tuple(self._tokens[i] for i in row.tolist())
+        tokens, keep, alias = self._distribution(prev_tokens)[2]
+        return (np.array(self._count.vocab().ids(tokens), dtype=np.uint32),
+                np.array(keep), np.array(alias, dtype=np.int64))
+
+
+class _FlatTables(object):
+    # Alias tables of several contexts laid out one after the other, so that
+    # sentences with different contexts are sampled with the same arrays.
+    # The aliases are relative to the start of each table.
+
+    def __init__(self):
+        self._positions = {}
+        self.ids = np.empty(0, dtype=np.uint32)
+        self.keep = np.empty(0)
+        self.alias = np.empty(0, dtype=np.int64)
+
+    def __len__(self):
+        return len(self._positions)
+
+    def positions(self, keys, make_table):
+        # start and size of the table of each key, making the missing ones
+        starts = np.empty(len(keys), dtype=np.int64)
+        sizes = np.empty(len(keys), dtype=np.int64)
+        new_tables = []
+        num_rows = len(self.ids)
+        for g, key in enumerate(keys):
+            position = self._positions.get(key)
+            if position is None:
+                table = make_table(key)
+                new_tables.append(table)
+                position = self._positions[key] = num_rows, len(table[0])
+                num_rows += len(table[0])
+            starts[g], sizes[g] = position
+        if new_tables:
+            new_ids, new_keep, new_alias = zip(*new_tables)
+            self.ids = np.concatenate((self.ids,) + new_ids)
+            self.keep = np.concatenate((self.keep,) + new_keep)
+            self.alias = np.concatenate((self.alias,) + new_alias)
+        return starts, sizes
+
+
+# generator of the pool processes, sent once to each of them
+_worker_generator = None
+
+
+def _init_worker(generator):
+    global _worker_generator
+    _worker_generator = generator
+
+
+def _generate_stream(stream):
+    num, seed = stream
+    return _worker_generator._generate_stream(num, seed)
+
+
+def alias_table(probs, total):
+    """Alias table for sampling from a distribution, built with Vose's method.
+
+    Returns the tokens, the probability of keeping each column and the index
+    of the alias of each column.
+
+    probs -- list of (token, probability) pairs.
+    total -- sum of the probabilities.
+    """
+    m = len(probs)
+    scale = m / total
+    tokens = [token for token, _ in probs]
+    keep = [p * scale for _, p in probs]
+    alias = list(range(m))
+    small = [i for i, p in enumerate(keep) if p < 1.0]
+    large = [i for i, p in enumerate(keep) if p >= 1.0]
+    while small and large:
+        i = small.pop()
+        j = large.pop()
+        alias[i] = j
+        keep[j] -= 1.0 - keep[i]
+        if keep[j] < 1.0:
+            small.append(j)
+        else:
+            large.append(j)
+    # what is left is full up to rounding errors
+    for i in small + large:
+        keep[i] = 1.0
+
+    return tokens, keep, alias
@@ -0,0 +1,148 @@
+"""Benchmarks for the language modeling code.
+
+Usage:
+  benchmark.py stores -n <n> [-m <num>]
+  benchmark.py generate [-n <n>] [-g <num>]
+  benchmark.py -h | --help
+
+Options:
+  stores        Compare memory and lookup latency of the count stores
+                (plain dict, sorted arrays and context trie).
+  generate      Compare the sentences per second generated with alias
+                tables against a linear scan of the sorted probabilities,
+                and with the lockstep bulk generation.
+  -n <n>        Order of the counts or the model [default: 3].
+  -m <num>      Number of test n-grams to look up [default: 100000].
+  -g <num>      Number of sentences to generate [default: 10000].
+  -h --help     Show this screen.
+"""
+from docopt import docopt
+import pickle
+import random
+import sys
+import time
+
+from languagemodeling.consts import START_TOKEN, END_TOKEN
+from languagemodeling.counts import count_ngrams
+from languagemodeling.ngram import NGram
+from languagemodeling.ngram_generator import NGramGenerator
+
+
+def dict_nbytes(d):
+    # the token strings are shared with the corpus, so they are not counted
+    size = sys.getsizeof(d)
+    for key, value in d.items():
+        size += sys.getsizeof(key) + sys.getsizeof(value)
+    return size
+
+
+def test_ngrams(sents, n, num):
+    ngrams = []
+    for sent in sents:
+        sent = [START_TOKEN] * (n - 1) + sent + [END_TOKEN]
+        for i in range(n - 1, len(sent)):
+            ngrams.append((tuple(sent[i - n + 1:i]), sent[i]))
+            if len(ngrams) == num:
+                return ngrams
+    return ngrams
+
+
+def time_lookups(f, ngrams):
+    start = time.perf_counter()
+    for prev_tokens, token in ngrams:
+        f(prev_tokens, token)
+    return (time.perf_counter() - start) / len(ngrams) * 1e6
+
+
+def bench_stores(train_sents, test_sents, n, num):
+    ngrams = test_ngrams(test_sents, n, num)
+
+    counts = count_ngrams(train_sents, n, all_ngrams=True)
+    d = dict(counts.items())
+
+    def dict_pair(prev_tokens, token):
+        return d.get(prev_tokens, 0), d.get(prev_tokens + (token,), 0)
+
+    def dict_suffixes(prev_tokens, token):
+        return [(d.get(prev_tokens[i:], 0), d.get(prev_tokens[i:] + (token,), 0))
+                for i in range(len(prev_tokens), -1, -1)]
+
+    stores = [('dict', dict_nbytes(d), dict_pair, dict_suffixes)]
+    for store in ['array', 'trie']:
+        counts = count_ngrams(train_sents, n, all_ngrams=True, store=store)
+        stores.append((store, counts.nbytes(),
+                       counts.count_pair, counts.suffix_counts))
+
+    print('{} n-grams, {} lookups'.format(len(d), len(ngrams)))
+    print('store\tMB\tpair (us)\tsuffixes (us)')
+    for name, nbytes, pair, suffixes in stores:
+        print('{}\t{:.1f}\t{:.2f}\t\t{:.2f}'.format(
+            name, nbytes / 2 ** 20,
+            time_lookups(pair, ngrams), time_lookups(suffixes, ngrams)))
+
+
+def scan_sent(generator):
+    # sentence generation by accumulating the sorted probabilities
+    n = generator._n
+    sent = [START_TOKEN] * (n - 1)
+    while END_TOKEN not in sent:
+        last_ngram = tuple(sent[len(sent) - n + 1:])
+        probs, cum_probs, _ = generator._distribution(last_ngram)
+        u = random.random() * cum_probs[-1]
+        i = 0
+        acum_prob = probs[i][1]
+        while acum_prob < u and i < len(probs) - 1:
+            i += 1
+            acum_prob += probs[i][1]
+        sent.append(probs[i][0])
+    return sent[n - 1:-1]
+
+
+def time_sents(f, num):
+    start = time.perf_counter()
+    num_tokens = 0
+    for i in range(num):
+        num_tokens += len(f()) + 1
+    elapsed = time.perf_counter() - start
+    return num / elapsed, num_tokens / elapsed
+
+
+def bench_generate(train_sents, n, num):
+    generator = NGramGenerator(NGram(n, train_sents))
+    scan = lambda: scan_sent(generator)
+
+    print('{} sentences'.format(num))
+    print('method\t\tsents/s\ttokens/s')
+    # the distributions are built lazily by the first run of each method,
+    # the second one samples from the same contexts
+    for name, f in [('alias (cold)', generator.generate_sent),
+                    (None, scan),
+                    ('scan', scan),
+                    ('alias', generator.generate_sent)]:
+        random.seed(0)
+        sents_per_sec, tokens_per_sec = time_sents(f, num)
+        if name is not None:
+            print('{:<16}{:.0f}\t{:.0f}'.format(name, sents_per_sec,
+                                                tokens_per_sec))
+
+    # lockstep generation, once to lay out the tables and once timed
+    list(generator.generate_sents(num, seed=0))
+    start = time.perf_counter()
+    num_tokens = sum(len(sent) + 1
+                     for sent in generator.generate_sents(num, seed=0))
+    elapsed = time.perf_counter() - start
+    print('{:<16}{:.0f}\t{:.0f}'.format('bulk', num / elapsed,
+                                        num_tokens / elapsed))
+    print('{} contexts visited'.format(len(generator._cache)))
+
+
+if __name__ == '__main__':
+    opts = docopt(__doc__)
+
+    with open('sents', 'rb') as fp:
+        [train_sents, test_sents] = pickle.load(fp)
+
+    if opts['stores']:
+        bench_stores(train_sents, test_sents, int(opts['-n']), int(opts['-m']))
+    elif opts['generate']:
+        bench_generate(train_sents, int(opts['-n']), int(opts['-g']))
@@ -4,9 +4,52 @@ from nltk.tokenize import word_tokenize, sent_tokenize
 
 
 CORPUS_DIR = 'corpus'
+# characters read from the corpus file before splitting them into sentences
+CHUNK_SIZE = 2 ** 20
+
 
 def load_corpus(fname):
+    return list(iter_corpus(fname))
+
+
+def iter_corpus(fname, chunk_size=CHUNK_SIZE):
+    """Iterate over the sentences of a corpus file, as lists of lowercased
+    tokens, reading the file in chunks of lines.
+
+    fname -- name of the file in CORPUS_DIR.
+    chunk_size -- approximate number of characters in each chunk.
+    """
     with open(os.path.join(CORPUS_DIR, fname), 'r') as fp:
-        data = fp.read()
-        sents = [[w.lower() for w in word_tokenize(sent)] for sent in sent_tokenize(data)]
-    return sents
+        yield from iter_sents(fp, chunk_size)
+
+
+def iter_sents(lines, chunk_size=CHUNK_SIZE):
+    """Iterate over the sentences of a text given as an iterable of lines,
+    as lists of lowercased tokens.
+
+    lines -- the lines of the text.
+    chunk_size -- approximate number of characters to split at a time.
+    """
+    rest = ''
+    chunk = []
+    size = 0
+    for line in lines:
+        chunk.append(line)
+        size += len(line)
+        if size >= chunk_size:
+            text = rest + ''.join(chunk)
+            sents = sent_tokenize(text)
+            # the last sentence may go on in the next chunk, so it is split
+            # again together with it
+            rest = text[text.rindex(sents.pop()):] if sents else text
+            for sent in sents:
+                yield tokenize(sent)
+            chunk = []
+            size = 0
+
+    for sent in sent_tokenize(rest + ''.join(chunk)):
+        yield tokenize(sent)
+
+
+def tokenize(sent):
+    return [w.lower() for w in word_tokenize(sent)]
@@ -1,40 +1,78 @@
 """Evaulate a language model using a test set.
 
 Usage:
-  eval.py -i <file>
+  eval.py -i <file> [-c <corpus>] [-s <file>]
+  eval.py compare <model>... [-c <corpus>] [-w <workers>]
   eval.py -h | --help
 
 Options:
-  -i <file>     Language model file.
+  -i <file>     Language model file (binary or pickle).
+  compare       Evaluate several models in one pass over the test sentences,
+                and print a table with their results.
+  -w <workers>  Number of threads scoring the models [default: 1]
+  -c <corpus>   Evaluate on a whole corpus file, reading it from disk while
+                scoring instead of using the saved test sentences.
+  -s <file>     Write the log-probability and number of tokens of each
+                sentence to a file.
   -h --help     Show this screen.
 """
 from docopt import docopt
 import pickle
 import math
+import os
 
 from nltk.corpus import gutenberg
 
+from languagemodeling.model_file import load_model
+from languagemodeling.ngram import evaluate_models
+from languagemodeling.scripts import corpus_helper
+
 
 if __name__ == '__main__':
     opts = docopt(__doc__)
 
-    # load the model
-    filename = opts['-i']
-    f = open(filename, 'rb')
-    model = pickle.load(f)
-    f.close()
+    # load the models
+    if opts['compare']:
+        filenames = opts['<model>']
+    else:
+        filenames = [opts['-i']]
+    models = [load_model(filename) for filename in filenames]
 
     # load the data
     # WORK HERE!! LOAD YOUR EVALUATION CORPUS
     # sents = gutenberg.sents('austen-persuasion.txt')
-    with open('sents', 'rb') as fp:
-        [train_sents, test_sents] = pickle.load(fp)
+    if opts['-c']:
+        test_sents = corpus_helper.iter_corpus(opts['-c'])
+    else:
+        with open('sents', 'rb') as fp:
+            [train_sents, test_sents] = pickle.load(fp)
+
+    if opts['compare']:
+        results = evaluate_models(models, test_sents,
+                                  workers=int(opts['-w']))
+        width = max(len(os.path.basename(f)) for f in filenames + ['model'])
+        print('{:<{w}}  {:>5}  {:>13}  {:>12}  {:>8}'.format(
+            'model', 'order', 'cross entropy', 'perplexity', 'seconds',
+            w=width))
+        for filename, model, result in zip(filenames, models, results):
+            print('{:<{w}}  {:>5}  {:>13.4f}  {:>12.2f}  {:>8.2f}'.format(
+                os.path.basename(filename), model._n,
+                result['cross_entropy'], result['perplexity'], result['time'],
+                w=width))
+    else:
+        model = models[0]
 
-    # compute the cross entropy
-    log_prob = model.log_prob(test_sents)
-    e = model.cross_entropy(test_sents)
-    p = model.perplexity(test_sents)
+        # compute the cross entropy, scoring the sentences once
+        scores_file = open(opts['-s'], 'w') if opts['-s'] else None
+        result = model.evaluate(test_sents, scores_file=scores_file)
+        if scores_file is not None:
+            scores_file.close()
 
-    print('Log probability: {}'.format(log_prob))
-    print('Cross entropy: {}'.format(e))
-    print('Perplexity: {}'.format(p))
+        print('Log probability: {}'.format(result['log_prob']))
+        print('Cross entropy: {}'.format(result['cross_entropy']))
+        print('Perplexity: {}'.format(result['perplexity']))
+        print('Sentences: {}, tokens: {}'.format(result['num_sents'],
+                                                 result['num_tokens']))
+        print('OOV rate: {:.2%}'.format(result['oov_rate']))
+        print('Zero probability tokens: {} ({} sentences)'.format(
+            result['zero_probs'], result['zero_prob_sents']))
@@ -1,17 +1,24 @@
 """Generate natural language sentences using a language model.
 
 Usage:
-  generate.py -i <file> -n <n>
+  generate.py -i <file> -n <n> [--cache-size <num>] [--seed <seed>] [-w <workers>] [-k <k>] [-p <p>]
   generate.py -h | --help
 
 Options:
-  -i <file>     Language model file.
+  -i <file>     Language model file (binary or pickle).
   -n <n>        Number of sentences to generate.
+  --cache-size <num>  Maximum number of context distributions to keep in
+                memory (default: all the visited ones).
+  --seed <seed>  Seed of the random streams, to get the same sentences again.
+  -w <workers>  Number of processes generating sentences [default: 1]
+  -k <k>        Sample only from the k most probable tokens of each context.
+  -p <p>        Sample only from the most probable tokens of each context
+                that add up to this fraction of its probability (nucleus).
   -h --help     Show this screen.
 """
 from docopt import docopt
-import pickle
 
+from languagemodeling.model_file import load_model
 from languagemodeling.ngram_generator import NGramGenerator
 
 
@@ -20,15 +27,22 @@ if __name__ == '__main__':
 
     # load the model
     filename = opts['-i']
-    f = open(filename, 'rb')
-    model = pickle.load(f)
-    f.close()
+    model = load_model(filename)
 
     # build generator
-    generator = NGramGenerator(model)
+    cache_size = opts['--cache-size']
+    if cache_size is not None:
+        cache_size = int(cache_size)
+    top_k = int(opts['-k']) if opts['-k'] else None
+    top_p = float(opts['-p']) if opts['-p'] else None
+    generator = NGramGenerator(model, cache_size=cache_size, top_k=top_k,
+                               top_p=top_p)
 
     # generate sentences
     n = int(opts['-n'])
-    for i in range(n):
-        sent = generator.generate_sent()
+    seed = opts['--seed']
+    if seed is not None:
+        seed = int(seed)
+    for sent in generator.generate_sents(n, seed=seed,
+                                         workers=int(opts['-w'])):
         print(' '.join(sent))
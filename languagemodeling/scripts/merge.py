@@ -0,0 +1,44 @@
+"""Merge n-gram models trained on separate shards of a corpus.
+
+Usage:
+  merge.py -o <file> [-s <store>] [--held-out <corpus>] [--max-memory <mb>] <model>...
+  merge.py -h | --help
+
+Options:
+  <model>       Model files (binary or pickle) with the same class and order.
+  -o <file>     Output model file (binary).
+  -s <store>    Count store to use [default: array]:
+                  array: Sorted arrays of n-gram ids.
+                  trie: Context trie over the sorted arrays.
+  --held-out <corpus>  Re-estimate gamma or beta on this corpus file (they
+                are taken from the first model otherwise).
+  --max-memory <mb>  Megabytes of count tables sorted in memory at a time
+                [default: 1024]
+  -h --help     Show this screen.
+"""
+import tempfile
+import os
+from docopt import docopt
+
+from languagemodeling.external_counts import merge_models
+from languagemodeling.model_file import load_model, save_model
+from languagemodeling.scripts import corpus_helper
+
+
+if __name__ == '__main__':
+    opts = docopt(__doc__)
+
+    models = [load_model(filename) for filename in opts['<model>']]
+
+    held_out = None
+    if opts['--held-out']:
+        held_out = corpus_helper.load_corpus(opts['--held-out'])
+
+    # the merged counts are mapped from a temporary file until they are saved
+    # with the model
+    with tempfile.TemporaryDirectory() as tmp:
+        model = merge_models(models, os.path.join(tmp, 'counts'),
+                             store=opts['-s'], held_out=held_out,
+                             max_bytes=int(opts['--max-memory']) * 2 ** 20,
+                             tmpdir=tmp)
+        save_model(model, opts['-o'])
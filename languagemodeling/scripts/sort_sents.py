@@ -1,34 +1,84 @@
 """Get the most probable order of a set of sentences
 
 Usage:
-    sent_sort.py -i <file>
+    sent_sort.py -i <file> [-b <width>] [--cache-size <num>] [--exact] [-w <workers>] [--seed <seed>]
     sent_sort.py -h | --help
 
 Options:
-    -i <file>   Input model file.
+    -i <file>   Input model file (binary or pickle).
+    -b <width>  Beam width, 1 for a greedy search [default: 1].
+    --cache-size <num>  Maximum number of transition scores kept between
+                sentences (default: all of them).
+    --exact     With bigram models, find the most probable order of the short
+                sentences exactly.
+    -w <workers>  Number of processes sorting sentences [default: 1]
+    --seed <seed>  Seed of the shuffle of the sentences [default: 96385]
     -h --help   Show this screen.
 """
 
+import multiprocessing
 import nltk
 import numpy as np
 import pickle
+import time
 from docopt import docopt
 
+from languagemodeling.model_file import load_model
 from languagemodeling.ngram import SentSorter
 
+# sorter of the worker processes, inherited when they are forked
+_sorter = None
+
+
+def sort_chunk(chunk):
+    """Sort a chunk of (shuffled, original) sentence pairs, returning the
+    sorted sentences and their edit distances to the originals.
+
+    chunk -- list of (shuffled, original) pairs.
+    """
+    sorted_sents = _sorter.sort_probable_sents([s for s, _ in chunk])
+    distances = [nltk.edit_distance(x, y)
+                 for x, (_, y) in zip(sorted_sents, chunk)]
+    return sorted_sents, distances
+
+
+def chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
 if __name__ == '__main__':
     opts = docopt(__doc__)
-    with open(opts['-i'], 'rb') as fp:
-        model = pickle.load(fp)
+    model = load_model(opts['-i'])
 
     with open('sents', 'rb') as fp:
         [train, test] = pickle.load(fp)
 
-    for _ in map(np.random.shuffle, test): pass
+    rng = np.random.default_rng(int(opts['--seed']))
+    shuffled = [sent.copy() for sent in test]
+    for _ in map(rng.shuffle, shuffled): pass
+
+    cache_size = opts['--cache-size']
+    if cache_size is not None:
+        cache_size = int(cache_size)
+    _sorter = SentSorter(model, beam_width=int(opts['-b']),
+                         cache_size=cache_size, exact=opts['--exact'])
 
-    ss = SentSorter(model)
-    sorted_sents = ss.sort_probable_sents(test)
+    start = time.perf_counter()
+    workers = int(opts['-w'])
+    pairs = list(zip(shuffled, test))
+    if workers == 1:
+        results = [sort_chunk(pairs)]
+    else:
+        # the workers are forked after loading the model, so they share its
+        # (read-only) pages instead of loading or unpickling it
+        size = max(len(pairs) // (4 * workers), 1)
+        with multiprocessing.get_context('fork').Pool(workers) as pool:
+            results = pool.map(sort_chunk, chunks(pairs, size))
+    sorted_sents = [sent for sents, _ in results for sent in sents]
+    distances = [d for _, ds in results for d in ds]
+    elapsed = time.perf_counter() - start
 
-    avg_edit_distance = [nltk.edit_distance(x, y) for x, y in zip(sorted_sents, test)]
-    avg_edit_distance = sum(avg_edit_distance) / len(avg_edit_distance)
+    avg_edit_distance = sum(distances) / len(distances)
     print("Average edit distance: {}".format(avg_edit_distance))
+    print("Sentences per second: {:.1f}".format(len(test) / elapsed))
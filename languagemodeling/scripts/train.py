@@ -1,7 +1,7 @@
 """Train an n-gram model.
 
 Usage:
-  train.py [-m <model>] -n <n> -o <file> [-a] [-g <gamma>] [-b <beta]
+  train.py [-m <model>] -n <n> -o <file> [-a] [-g <gamma>] [-b <beta] [-s <store>] [-f <format>] [-w <workers>] [--stream] [--max-memory <mb>] [--compile] [-p <threshold> | --prune-size <num>] [-q <bits>]
   train.py -h | --help
 
 Options:
@@ -10,20 +10,50 @@ Options:
                   ngram: Unsmoothed n-grams.
                   addone: N-grams with add-one smoothing.
                   inter: N-grams with interpolation smoothing.
+                  backoff: N-grams with back-off and discounting.
+                  kn: N-grams with modified Kneser-Ney smoothing.
   -o <file>     Output model file.
   -a            Addone = True (only for InterpolatedNGram model)
   -g <gamma>    Gamma (InterpolatedNGram model) [default: None]
   -b <beta>     Beta (Backoff model) [default: None]
+  -s <store>    Count store to use [default: array]:
+                  array: Sorted arrays of n-gram ids.
+                  trie: Context trie over the sorted arrays.
+  -f <format>   Output file format [default: binary]:
+                  binary: Memory-mapped model file.
+                  pickle: Pickled model object.
+                  arpa: ARPA text file (implies --compile).
+  -w <workers>  Number of processes counting n-grams [default: 1]
+  --stream      Train on the whole corpus, reading it from disk while counting
+                instead of loading it (no shuffling nor test split, so it
+                needs -g or -b for the interpolated and backoff models).
+  --max-memory <mb>  Count with at most this many megabytes of count tables in
+                memory, spilling them to <file>-<n>.counts, and train from it
+                (needs -g or -b for the interpolated and backoff models).
+  --compile     Compile the model (inter, backoff or kn) to tables of
+                log-probabilities and backoff weights before saving it.
+  -p <threshold>  Prune the compiled model (implies --compile), removing the
+                n-grams that increase the perplexity less than this (relative)
+                amount, reporting the change in size and test perplexity.
+  --prune-size <num>  Prune the compiled model to about this many n-grams of
+                order > 1 instead.
+  -q <bits>     Quantize the compiled model to 8 or 16 bits per value (implies
+                --compile), reporting the change in size and test perplexity.
   -h --help     Show this screen.
 """
-from docopt import docopt
+from docopt import docopt, DocoptExit
 import pickle
 import numpy as np
 
 from nltk.corpus import gutenberg
 
 from languagemodeling.consts import MODELS_DIR, SEED, TRAIN_PER
-from languagemodeling.ngram import NGram, AddOneNGram, InterpolatedNGram, BackOffNGram
+from languagemodeling.compiled import compile_model, prune_model, \
+    quantize_model, save_arpa
+from languagemodeling.external_counts import count_ngrams_external
+from languagemodeling.model_file import save_model
+from languagemodeling.ngram import NGram, AddOneNGram, InterpolatedNGram, BackOffNGram, \
+    KneserNeyNGram
 from languagemodeling.scripts import corpus_helper
 
 
@@ -31,9 +61,30 @@ models = {
     'ngram': NGram,
     'addone': AddOneNGram,
     'inter': InterpolatedNGram,
-    'backoff': BackOffNGram
+    'backoff': BackOffNGram,
+    'kn': KneserNeyNGram,
 }
 
+# option with the hyper-parameter of the models that otherwise estimate it on
+# held-out sentences
+HELD_OUT_OPTS = {
+    'inter': '-g',
+    'backoff': '-b',
+}
+
+
+def check_opts(opts):
+    # splitting off held-out sentences needs the whole corpus in memory, so
+    # the options that avoid it fail before reading the corpus
+    opt = HELD_OUT_OPTS.get(opts['-m'])
+    if opt is None or opts[opt] != 'None':
+        return
+    for name in ['--stream', '--max-memory']:
+        if opts[name]:
+            raise DocoptExit('{} needs {} with the {} model'.format(
+                name, opt, opts['-m']))
+
+
 def get_sents(load_sents):
     if load_sents:
         with open('sents', 'rb') as fp:
@@ -53,11 +104,25 @@ def get_sents(load_sents):
     return train_sents, test_sents
 
 
+def report(before, after, test_sents):
+    print('Size: {:.1f} MB -> {:.1f} MB'.format(
+        before.nbytes() / 2 ** 20, after.nbytes() / 2 ** 20))
+    if test_sents is not None:
+        before = before.perplexity(test_sents)
+        after = after.perplexity(test_sents)
+        print('Perplexity: {} -> {} ({:+.2%})'.format(
+            before, after, after / before - 1))
+
+
 if __name__ == '__main__':
     opts = docopt(__doc__)
+    check_opts(opts)
 
     load_sents = False
-    train_sents, test_sents = get_sents(load_sents)
+    if opts['--stream']:
+        train_sents = corpus_helper.iter_corpus('lavoz.corpus')
+    else:
+        train_sents, test_sents = get_sents(load_sents)
 
     # train the model
     n = int(opts['-n'])
@@ -65,16 +130,50 @@ if __name__ == '__main__':
     addone =  opts['-a']
     gamma = float(opts['-g']) if opts['-g'] != 'None' else None
     beta = float(opts['-b']) if opts['-b'] != 'None' else None
+    store = opts['-s']
+    workers = int(opts['-w'])
+
+    if opts['--max-memory']:
+        all_ngrams = opts['-m'] in ['inter', 'backoff', 'kn']
+        train_sents = count_ngrams_external(
+            train_sents, n, opts['-o'] + '-%s.counts' % n, all_ngrams=all_ngrams,
+            store=store, max_bytes=int(opts['--max-memory']) * 2 ** 20)
 
     if opts['-m'] == 'inter':
-        model = model_class(n, train_sents, gamma=gamma, addone=addone)
+        model = model_class(n, train_sents, gamma=gamma, addone=addone,
+                            store=store, workers=workers)
     elif opts['-m'] == 'backoff':
-        model = model_class(n, train_sents, beta=beta, addone=addone)
+        model = model_class(n, train_sents, beta=beta, addone=addone,
+                            store=store, workers=workers)
     else:
-        model = model_class(n, train_sents)
+        model = model_class(n, train_sents, store=store, workers=workers)
+
+    if opts['--compile'] or opts['-f'] == 'arpa' or opts['-q'] or \
+            opts['-p'] or opts['--prune-size']:
+        model = compile_model(model)
+
+    if opts['-p'] or opts['--prune-size']:
+        compiled = model
+        if opts['-p']:
+            model = prune_model(compiled, threshold=float(opts['-p']))
+        else:
+            model = prune_model(compiled, size=int(opts['--prune-size']))
+        print('N-grams: {} -> {}'.format(
+            sum(compiled.num_ngrams().values()), sum(model.num_ngrams().values())))
+        report(compiled, model, None if opts['--stream'] else test_sents)
+
+    if opts['-q']:
+        compiled = model
+        model = quantize_model(compiled, int(opts['-q']))
+        report(compiled, model, None if opts['--stream'] else test_sents)
 
     # save it
-    filename = opts['-o']
-    f = open(filename + '-%s.model' % n, 'wb')
-    pickle.dump(model, f)
-    f.close()
+    filename = opts['-o'] + '-%s.model' % n
+    if opts['-f'] == 'arpa':
+        save_arpa(model, opts['-o'] + '-%s.arpa' % n)
+    elif opts['-f'] == 'pickle':
+        f = open(filename, 'wb')
+        pickle.dump(model, f)
+        f.close()
+    else:
+        save_model(model, filename)
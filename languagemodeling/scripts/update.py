@@ -0,0 +1,37 @@
+"""Add new sentences to a trained language model.
+
+Usage:
+  update.py -i <file> -c <corpus> -o <file> [--held-out <corpus>]
+  update.py -h | --help
+
+Options:
+  -i <file>     Language model file (binary or pickle).
+  -c <corpus>   Corpus file with the new sentences, read from disk while
+                counting.
+  -o <file>     Output model file (binary), that may be the input one (it is
+                replaced once the updated model is written).
+  --held-out <corpus>  Re-estimate gamma or beta on this corpus file (they
+                are kept otherwise).
+  -h --help     Show this screen.
+"""
+from docopt import docopt
+
+from languagemodeling.model_file import load_model, save_model
+from languagemodeling.ngram import NGram
+from languagemodeling.scripts import corpus_helper
+
+
+if __name__ == '__main__':
+    opts = docopt(__doc__)
+
+    model = load_model(opts['-i'])
+    if not isinstance(model, NGram):
+        raise TypeError('can not update a {}, it keeps no counts'.format(
+            type(model).__name__))
+
+    held_out = None
+    if opts['--held-out']:
+        held_out = corpus_helper.load_corpus(opts['--held-out'])
+    model.update(corpus_helper.iter_corpus(opts['-c']), held_out=held_out)
+
+    save_model(model, opts['-o'])
@@ -117,3 +117,17 @@ class TestAddOneNGram(TestCase):
             prob_sum = sum(model.cond_prob(token, prev) for token in tokens)
             # prob_sum < 1.0 or almost equal to 1.0:
             self.assertTrue(prob_sum < 1.0 or abs(prob_sum - 1.0) < 1e-10)
+
+    def test_score_batch(self):
+        sents = [s.split() for s in [
+            'el gato come pescado .',
+            'la gata come salame .',
+            '',
+        ]]
+        for n in range(1, 4):
+            model = AddOneNGram(n, self.sents)
+            scores = model.score_batch(sents)
+            for sent, score in zip(sents, scores):
+                self.assertAlmostEqual(score, model.sent_log_prob(sent), msg=sent)
+            self.assertEqual(len(model.score_batch([])), 0)
+            self.assertEqual(model.log_prob([]), 0)
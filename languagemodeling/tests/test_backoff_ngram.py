@@ -248,5 +248,105 @@ class TestBackoffNGram(TestCase):
         for gram, c in counts.items():
             self.assertEqual(model.count(gram), c, gram)
 
+    def test_trie_store(self):
+        model = BackOffNGram(3, self.sents, beta=0.5)
+        trie_model = BackOffNGram(3, self.sents, beta=0.5, store='trie')
+
+        tokens = ['el', 'gato', 'come', 'pescado', '.', 'salame', '</s>']
+        prevs = [('<s>', '<s>'), ('<s>', 'el'), ('el', 'come'), ('gato', 'come')]
+        for prev in prevs:
+            for token in tokens:
+                self.assertAlmostEqual(trie_model.cond_prob(token, prev),
+                                       model.cond_prob(token, prev))
+
+    def test_held_out_iterable(self):
+        model = BackOffNGram(1, iter(self.sents))
+
+        self.assertEqual(model.count(()), 6)
+
+    def test_score_batch(self):
+        sents = [s.split() for s in [
+            'el gato come pescado .',
+            'la gata come salame .',
+            '',
+        ]]
+        for n in range(1, 4):
+            for addone in [True, False]:
+                model = BackOffNGram(n, self.sents, beta=0.5, addone=addone)
+                scores = model.score_batch(sents)
+                for sent, score in zip(sents, scores):
+                    self.assertAlmostEqual(score, model.sent_log_prob(sent), msg=sent)
+                self.assertEqual(len(model.score_batch([])), 0)
+                self.assertEqual(model.log_prob([]), 0)
+
+    def test_denoms(self):
+        prevs = [('<s>', '<s>'), ('<s>', 'el'), ('el', 'gato'), ('come',), ('.',), ('<s>',)]
+        for beta in [0.0, 0.5, 0.8]:
+            for addone in [True, False]:
+                model = BackOffNGram(3, self.sents, beta=beta, addone=addone)
+                for prev in prevs:
+                    denom = 1 - sum(model.cond_prob(token, prev[1:])
+                                    for token in model.A(prev))
+                    self.assertAlmostEqual(model.denom(prev), denom, msg=prev)
+
+    def test_cache(self):
+        model = BackOffNGram(3, self.sents, beta=0.5, cache_size=16)
+        tokens = ['el', 'gato', 'come', 'salame', '</s>']
+        prevs = [('<s>', '<s>'), ('el', 'gato'), ('gato', 'come'), ('salame', 'come')]
+
+        for beta in [0.5, 0.2]:
+            model._beta = beta
+            model._compute_denoms()
+            model._compute_alpha()
+            uncached = BackOffNGram(3, self.sents, beta=beta)
+            for _ in range(2):
+                for prev in prevs:
+                    for token in tokens:
+                        self.assertEqual(model.cond_prob(token, prev),
+                                         uncached.cond_prob(token, prev))
+
+        info = model.cache_info()
+        self.assertGreater(info['hits'], 0)
+        self.assertGreater(info['misses'], 0)
+        self.assertEqual(info['maxsize'], 16)
+        self.assertIsNone(uncached.cache_info())
+
+    def test_update(self):
+        new_sents = [
+            'el gato come salmón .'.split(),
+            'un perro come carne .'.split(),
+        ]
+        test_sents = [
+            'la gata come carne .'.split(),
+            'un gato come pescado .'.split(),
+        ]
+        for n in [1, 2, 3]:
+            for addone in [True, False]:
+                model = BackOffNGram(n, self.sents, beta=0.5, addone=addone)
+                model.update(iter(new_sents))
+                full = BackOffNGram(n, self.sents + new_sents, beta=0.5,
+                                    addone=addone)
+
+                self.assertEqual(model._V, full._V)
+                for k in range(1, n):
+                    self.assertEqual(model._A[k].tolist(), full._A[k].tolist())
+                    for a, b in [(model._alpha, full._alpha),
+                                 (model._denoms, full._denoms)]:
+                        for x, y in zip(a[k].tolist(), b[k].tolist()):
+                            self.assertAlmostEqual(x, y)
+                for x, y in zip(model.score_batch(test_sents).tolist(),
+                                full.score_batch(test_sents).tolist()):
+                    self.assertAlmostEqual(x, y)
+
+    def test_update_held_out(self):
+        model = BackOffNGram(2, self.sents, beta=0.5)
+        model.update(self.sents)
+        self.assertEqual(model._beta, 0.5)
+
+        model.update(self.sents, held_out=self.sents)
+        full = BackOffNGram(2, self.sents * 3, beta=model._beta)
+        self.assertAlmostEqual(model.cond_prob('salmón', ('el',)),
+                               full.cond_prob('salmón', ('el',)))
+
     def assertAlmostLessEqual(self, a, b, places=7, msg=None):
         self.assertTrue(a < b or round(abs(a - b), places) == 0, msg=msg)
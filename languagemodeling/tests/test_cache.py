@@ -0,0 +1,19 @@
+# https://docs.python.org/3/library/unittest.html
+from unittest import TestCase
+
+from languagemodeling.cache import LRUCache
+
+
+class TestLRUCache(TestCase):
+
+    def test_lru(self):
+        cache = LRUCache(2)
+        cache['a'] = 1
+        cache['b'] = 2
+        self.assertEqual(cache.get('a'), 1)
+        cache['c'] = 3  # drops 'b', the least recently used
+
+        self.assertNotIn('b', cache)
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('c'), 3)
+        self.assertEqual(cache.info(), {'hits': 2, 'misses': 1, 'size': 2, 'maxsize': 2})
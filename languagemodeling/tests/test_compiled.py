@@ -0,0 +1,123 @@
+# https://docs.python.org/3/library/unittest.html
+from unittest import TestCase
+import os
+import tempfile
+
+import numpy as np
+
+from languagemodeling.compiled import compile_model, quantize_model, \
+    prune_model, save_arpa, load_arpa, _train_codebook
+from languagemodeling.external_counts import merge_models
+from languagemodeling.ngram import NGram, InterpolatedNGram, BackOffNGram
+from languagemodeling.ngram_generator import NGramGenerator
+
+
+class TestCompiledNGram(TestCase):
+
+    def setUp(self):
+        self.sents = [
+            'el gato come pescado .'.split(),
+            'la gata come salmón .'.split(),
+        ]
+        self.test_sents = [
+            'el gato come salmón .'.split(),
+            'la gata come salame .'.split(),
+        ]
+        self.models = [
+            InterpolatedNGram(3, self.sents, gamma=1.0),
+            InterpolatedNGram(3, self.sents, gamma=1.0, addone=False),
+            BackOffNGram(3, self.sents, beta=0.5),
+            BackOffNGram(3, self.sents, beta=0.5, addone=False),
+        ]
+
+    def test_same_probs(self):
+        tokens = ['el', 'gato', 'come', 'salmón', 'salame', '</s>']
+        prevs = [('<s>', '<s>'), ('<s>', 'el'), ('gato', 'come'), ('la', 'come'), ('come', 'salame')]
+        for model in self.models:
+            compiled = compile_model(model)
+            for prev in prevs:
+                for token in tokens:
+                    self.assertAlmostEqual(compiled.cond_prob(token, prev),
+                                           model.cond_prob(token, prev))
+            for sent in self.test_sents:
+                self.assertAlmostEqual(compiled.sent_log_prob(sent),
+                                       model.sent_log_prob(sent))
+
+    def test_arpa(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, 'model.arpa')
+            for model in self.models:
+                compiled = compile_model(model)
+                save_arpa(compiled, filename)
+                loaded = load_arpa(filename)
+
+                # <unk> is written as a unigram if the model has addone
+                self.assertEqual(loaded.num_ngrams()[3], compiled.num_ngrams()[3])
+                for sent in self.test_sents:
+                    self.assertAlmostEqual(loaded.sent_log_prob(sent),
+                                           model.sent_log_prob(sent))
+
+    def test_not_compilable(self):
+        with self.assertRaises(TypeError):
+            compile_model(NGram(2, self.sents))
+
+    def test_needs_counts(self):
+        compiled = compile_model(self.models[0])
+        quantized = quantize_model(compiled)
+        for model in [compiled, quantized]:
+            self.assertNotIsInstance(model, NGram)
+            with self.assertRaises(TypeError):
+                NGramGenerator(model)
+            with tempfile.TemporaryDirectory() as tmpdir:
+                with self.assertRaises(TypeError):
+                    merge_models([model, model], os.path.join(tmpdir, 'counts'))
+
+    def test_score_batch(self):
+        for model in self.models:
+            compiled = compile_model(model)
+            np.testing.assert_allclose(compiled.score_batch(self.test_sents),
+                                       model.score_batch(self.test_sents))
+            result = compiled.evaluate(self.test_sents)
+            self.assertAlmostEqual(result['perplexity'],
+                                   model.perplexity(self.test_sents))
+
+    def test_quantize(self):
+        for model in self.models:
+            compiled = compile_model(model)
+            # the tables have fewer distinct values than codes
+            quantized = quantize_model(compiled, bits=8)
+
+            self.assertLess(quantized.nbytes(), compiled.nbytes())
+            for sent in self.test_sents:
+                self.assertAlmostEqual(quantized.sent_log_prob(sent),
+                                       compiled.sent_log_prob(sent))
+
+    def test_codebook(self):
+        values = np.concatenate([np.linspace(-5, 0, 1000), [-np.inf]])
+        codebook, codes = _train_codebook(values, 8)
+
+        self.assertEqual(len(codebook), 256)
+        self.assertEqual(codes.dtype, np.uint8)
+        self.assertEqual(codebook[codes[-1]], -np.inf)
+        self.assertLess(np.abs(codebook[codes[:-1]] - values[:-1]).max(), 0.02)
+
+    def test_prune(self):
+        tokens = ['el', 'gato', 'la', 'gata', 'come', 'pescado', 'salmón', '.', '</s>']
+        prevs = [('<s>', '<s>'), ('<s>', 'el'), ('gato', 'come'), ('come', 'salmón')]
+        for model in self.models:
+            compiled = compile_model(model)
+
+            pruned = prune_model(compiled, threshold=-np.inf)
+            self.assertEqual(pruned.num_ngrams(), compiled.num_ngrams())
+            for sent in self.test_sents:
+                self.assertAlmostEqual(pruned.sent_log_prob(sent),
+                                       compiled.sent_log_prob(sent))
+
+            pruned = prune_model(compiled, size=10)
+            num_ngrams = pruned.num_ngrams()
+            self.assertLess(num_ngrams[2] + num_ngrams[3], 24)
+            self.assertEqual(num_ngrams[1], compiled.num_ngrams()[1])
+            # the distributions still sum to 1
+            for prev in prevs:
+                self.assertAlmostEqual(sum(pruned.cond_prob(token, prev) for token in tokens),
+                                       sum(compiled.cond_prob(token, prev) for token in tokens))
@@ -0,0 +1,38 @@
+# https://docs.python.org/3/library/unittest.html
+from unittest import TestCase
+
+from nltk.tokenize import sent_tokenize
+
+from languagemodeling.scripts.corpus_helper import iter_sents, tokenize
+
+
+class TestCorpusHelper(TestCase):
+
+    def setUp(self):
+        self.lines = [
+            'El gato come pescado. La gata\n',
+            'come salmón. El perro\n',
+            'come carne mientras la gata come pescado y el perro duerme.\n',
+            'Fin.\n',
+        ]
+        try:
+            sent_tokenize('Hola.')
+        except LookupError:
+            self.skipTest('the nltk punkt tokenizer is not installed')
+
+    def test_iter_sents(self):
+        text = ''.join(self.lines)
+        expected = [tokenize(sent) for sent in sent_tokenize(text)]
+        # the second and third sentences go on in the next line
+        self.assertEqual(len(expected), 4)
+        self.assertEqual(expected[1], 'la gata come salmón .'.split())
+        self.assertEqual(expected[2][:4], 'el perro come carne'.split())
+
+        # a line at a time, a few characters (shorter than the third
+        # sentence) and the whole text at once
+        for chunk_size in [1, 10, len(text) + 1]:
+            sents = list(iter_sents(iter(self.lines), chunk_size))
+            self.assertEqual(sents, expected, chunk_size)
+
+    def test_iter_sents_empty(self):
+        self.assertEqual(list(iter_sents([], 1)), [])
@@ -0,0 +1,132 @@
+# https://docs.python.org/3/library/unittest.html
+from unittest import TestCase
+
+from languagemodeling.counts import Vocabulary, NGramCounts, count_ngrams, UNK_ID
+
+
+class TestVocabulary(TestCase):
+
+    def test_ids(self):
+        vocab = Vocabulary('el gato come'.split())
+
+        self.assertEqual(len(vocab), 5)
+        self.assertEqual(vocab.ids(['<s>', '</s>', 'el', 'gato', 'come']),
+                         [0, 1, 2, 3, 4])
+        self.assertEqual(vocab.id('salame'), UNK_ID)
+        self.assertEqual(vocab.add('salame'), 5)
+        self.assertEqual(vocab.token(5), 'salame')
+
+
+class TestNGramCounts(TestCase):
+
+    def setUp(self):
+        self.sents = [
+            'el gato come pescado .'.split(),
+            'la gata come salmón .'.split(),
+        ]
+
+    def test_add(self):
+        counts = NGramCounts(Vocabulary('a b c'.split()))
+        counts.add(2, [[2, 3], [3, 4], [2, 3]])
+        counts.add(2, [[3, 4], [4, 2]], [5, 1])
+
+        self.assertEqual(dict(counts.items()), {
+            (): 0,
+            ('a', 'b'): 2,
+            ('b', 'c'): 6,
+            ('c', 'a'): 1,
+        })
+
+    def test_count_ngrams_2gram(self):
+        counts = count_ngrams(self.sents, 2)
+
+        self.assertEqual(counts[()], 12)
+        self.assertEqual(counts[('<s>',)], 2)
+        self.assertEqual(counts[('come', 'pescado')], 1)
+        self.assertEqual(counts[('.', '</s>')], 2)
+        self.assertEqual(counts.get(('come', 'salame'), 0), 0)
+        self.assertNotIn(('salame',), counts)
+        self.assertEqual(len(counts), 22)
+
+    def test_count_ngrams_chunks(self):
+        # the result does not depend on the size of the chunks
+        for n in range(1, 4):
+            counts = dict(count_ngrams(self.sents, n, all_ngrams=True).items())
+            for chunk_size in [1, 3, 8]:
+                chunked = count_ngrams(self.sents, n, all_ngrams=True,
+                                       chunk_size=chunk_size)
+                self.assertEqual(dict(chunked.items()), counts)
+
+    def test_lookup(self):
+        counts = count_ngrams(self.sents, 2)
+        ids = [counts.vocab().ids(t) for t in [('come', 'pescado'), ('.', '</s>'), ('come', 'salame')]]
+
+        self.assertEqual(counts.lookup(2, ids).tolist(), [1, 2, 0])
+        self.assertEqual(counts.lookup(0, ids).tolist(), [12, 12, 12])
+        self.assertEqual(counts.find(2, ids)[2], -1)
+
+
+class TestTrieCounts(TestCase):
+
+    def setUp(self):
+        self.sents = [
+            'el gato come pescado .'.split(),
+            'la gata come salmón .'.split(),
+        ]
+
+    def test_same_counts(self):
+        for n in range(1, 4):
+            for all_ngrams in [False, True]:
+                counts = count_ngrams(self.sents, n, all_ngrams)
+                trie = count_ngrams(self.sents, n, all_ngrams, store='trie')
+                self.assertEqual(dict(trie.items()), dict(counts.items()))
+
+    def test_suffix_counts(self):
+        trie = count_ngrams(self.sents, 3, all_ngrams=True, store='trie')
+
+        self.assertEqual(trie.suffix_counts(('gato', 'come'), 'pescado'),
+                         [(12, 1), (2, 1), (1, 1)])
+        self.assertEqual(trie.suffix_counts(('gato', 'come'), 'salmón'),
+                         [(12, 1), (2, 1), (1, 0)])
+        self.assertEqual(trie.suffix_counts(('salame', 'come'), 'salmón'),
+                         [(12, 1), (2, 1), (0, 0)])
+        self.assertEqual(trie.suffix_counts(('<s>', '<s>'), 'el'),
+                         [(12, 1), (2, 1), (2, 1)])
+
+    def test_count_pair(self):
+        trie = count_ngrams(self.sents, 2, store='trie')
+
+        self.assertEqual(trie.count_pair(('come',), 'pescado'), (2, 1))
+        self.assertEqual(trie.count_pair(('come',), 'salame'), (2, 0))
+        self.assertEqual(trie.count_pair(('salame',), 'come'), (0, 0))
+
+
+class TestParallelCounts(TestCase):
+
+    def setUp(self):
+        self.sents = [
+            'el gato come pescado .'.split(),
+            'la gata come salmón .'.split(),
+            'el perro come carne .'.split(),
+        ]
+
+    def test_same_tables(self):
+        for n in range(1, 4):
+            counts = count_ngrams(self.sents, n, all_ngrams=True)
+            parallel = count_ngrams(self.sents, n, all_ngrams=True,
+                                    workers=2, chunk_size=4)
+
+            self.assertEqual(parallel.vocab().tokens(), counts.vocab().tokens())
+            self.assertEqual(parallel[()], counts[()])
+            for k in counts.orders():
+                ids, c = counts.table(k)
+                parallel_ids, parallel_c = parallel.table(k)
+                self.assertEqual(parallel_ids.tolist(), ids.tolist())
+                self.assertEqual(parallel_c.tolist(), c.tolist())
+
+    def test_add_counts(self):
+        counts = count_ngrams(self.sents[:1], 2)
+        counts.add_counts(count_ngrams(self.sents[1:], 2))
+
+        self.assertEqual(dict(counts.items()),
+                         dict(count_ngrams(self.sents, 2).items()))
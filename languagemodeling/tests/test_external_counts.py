@@ -0,0 +1,91 @@
+# https://docs.python.org/3/library/unittest.html
+from unittest import TestCase
+import os
+import tempfile
+
+from languagemodeling.counts import count_ngrams
+from languagemodeling.external_counts import count_ngrams_external, \
+    merge_counts, merge_models
+from languagemodeling.ngram import NGram, InterpolatedNGram, BackOffNGram, \
+    KneserNeyNGram
+
+
+class TestExternalCounts(TestCase):
+
+    def setUp(self):
+        self.sents = [
+            'el gato come pescado .'.split(),
+            'la gata come salmón .'.split(),
+            'el perro come carne .'.split(),
+        ]
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.tmpdir.name, 'counts')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_same_tables(self):
+        for n in range(1, 4):
+            for store in ['array', 'trie']:
+                counts = count_ngrams(self.sents, n, all_ngrams=True)
+                # spill after every sentence
+                external = count_ngrams_external(
+                    iter(self.sents), n, self.filename, all_ngrams=True,
+                    store=store, max_bytes=1, chunk_size=4)
+
+                self.assertEqual(external.vocab().tokens(), counts.vocab().tokens())
+                self.assertEqual(dict(external.items()), dict(counts.items()))
+
+    def test_train_from_counts(self):
+        counts = count_ngrams_external(self.sents, 2, self.filename, max_bytes=1)
+        model = NGram(2, counts)
+
+        self.assertAlmostEqual(model.cond_prob('pescado', ('come',)), 1 / 3)
+        with self.assertRaises(ValueError):
+            NGram(3, counts)
+        with self.assertRaises(ValueError):
+            InterpolatedNGram(2, counts)
+
+    def test_merge_counts(self):
+        shards = [self.sents[:1], self.sents[1:]]
+        for n in range(1, 4):
+            for store in ['array', 'trie']:
+                counts = count_ngrams(self.sents, n, all_ngrams=True)
+                # re-sort the remapped tables a row at a time
+                merged = merge_counts(
+                    [count_ngrams(shard, n, all_ngrams=True) for shard in shards],
+                    self.filename, store=store, max_bytes=1)
+
+                self.assertEqual(merged.vocab().tokens(), counts.vocab().tokens())
+                self.assertEqual(dict(merged.items()), dict(counts.items()))
+
+        with self.assertRaises(ValueError):
+            merge_counts([count_ngrams(self.sents, 3),
+                          count_ngrams(self.sents, 3, all_ngrams=True)],
+                         self.filename)
+
+    def test_merge_models(self):
+        shards = [self.sents[:2], self.sents[2:]]
+        test_sents = [
+            'el gato come carne .'.split(),
+            'la perra come queso .'.split(),
+        ]
+        models = [
+            lambda sents: NGram(2, sents),
+            lambda sents: InterpolatedNGram(3, sents, gamma=2.0),
+            lambda sents: BackOffNGram(3, sents, beta=0.5),
+            lambda sents: KneserNeyNGram(3, sents),
+        ]
+        for make_model in models:
+            merged = merge_models([make_model(shard) for shard in shards],
+                                  self.filename)
+            model = make_model(self.sents)
+
+            self.assertIs(type(merged), type(model))
+            for x, y in zip(merged.score_batch(test_sents).tolist(),
+                            model.score_batch(test_sents).tolist()):
+                self.assertAlmostEqual(x, y)
+
+        with self.assertRaises(ValueError):
+            merge_models([NGram(2, self.sents), NGram(3, self.sents)],
+                         self.filename)
@@ -173,5 +173,52 @@ class TestInterpolatedNGram(TestCase):
         for gram, c in counts.items():
             self.assertEqual(model.count(gram), c, gram)
 
+    def test_score_batch(self):
+        sents = [s.split() for s in [
+            'el gato come pescado .',
+            'la gata come salame .',
+            '',
+        ]]
+        for n in range(1, 4):
+            for addone in [True, False]:
+                model = InterpolatedNGram(n, self.sents, gamma=1.0, addone=addone)
+                scores = model.score_batch(sents)
+                for sent, score in zip(sents, scores):
+                    self.assertAlmostEqual(score, model.sent_log_prob(sent), msg=sent)
+                self.assertEqual(len(model.score_batch([])), 0)
+                self.assertEqual(model.log_prob([]), 0)
+
+    def test_compute_gamma(self):
+        model = InterpolatedNGram(2, self.sents, gamma=1.0)
+        held_out = [s.split() for s in ['el gato come pescado .', 'gato la come .']]
+        gammas = [0.5, 1.0, 2.0, 5.0, 10.0]
+
+        perplexities = []
+        for gamma in gammas:
+            model._gamma = gamma
+            perplexities.append(model.perplexity(held_out))
+        best_gamma = gammas[perplexities.index(min(perplexities))]
+
+        self.assertEqual(model._compute_gamma(held_out, gammas), best_gamma)
+
+    def test_update(self):
+        new_sents = [s.split() for s in [
+            'el perro come carne .',
+            'la gata come pescado .',
+        ]]
+        sents = [s.split() for s in [
+            'el perro come salmón .',
+            'un gato come salame .',
+        ]]
+        for n in range(1, 4):
+            for addone in [True, False]:
+                model = InterpolatedNGram(n, self.sents, gamma=1.0, addone=addone)
+                model.update(new_sents)
+                full = InterpolatedNGram(n, self.sents + new_sents, gamma=1.0,
+                                         addone=addone)
+                for sent in sents:
+                    self.assertAlmostEqual(model.sent_log_prob(sent),
+                                           full.sent_log_prob(sent), msg=sent)
+
     def assertAlmostLessEqual(self, a, b, places=7, msg=None):
         self.assertTrue(a < b or round(abs(a - b), places) == 0, msg=msg)
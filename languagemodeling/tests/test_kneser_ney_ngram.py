@@ -0,0 +1,104 @@
+# https://docs.python.org/3/library/unittest.html
+from unittest import TestCase
+
+import numpy as np
+
+from languagemodeling.ngram import KneserNeyNGram
+from languagemodeling.ngram_generator import NGramGenerator
+
+
+class TestKneserNeyNGram(TestCase):
+
+    def setUp(self):
+        self.sents = [
+            'el gato come pescado .'.split(),
+            'la gata come salmón .'.split(),
+            'el perro come carne .'.split(),
+            'la gata come pescado .'.split(),
+        ]
+        self.tokens = ['el', 'gato', 'come', 'pescado', '.', 'la', 'gata',
+                       'salmón', 'perro', 'carne', '</s>']
+
+    def test_count_2gram(self):
+        model = KneserNeyNGram(2, self.sents)
+
+        counts = {
+            (): 24,
+            ('come',): 4,
+            ('pescado',): 2,
+            ('<s>', 'el'): 2,
+            ('come', 'pescado'): 2,
+            ('.', '</s>'): 4,
+        }
+        for gram, c in counts.items():
+            self.assertEqual(model.count(gram), c, gram)
+
+    def test_cond_prob_1gram(self):
+        model = KneserNeyNGram(1, self.sents)
+
+        # with no lower order, the discounted mass is spread uniformly
+        for token in self.tokens:
+            self.assertGreater(model.cond_prob(token), 0.0, token)
+        self.assertAlmostEqual(model.cond_prob('come'),
+                               max(model.cond_prob(t) for t in self.tokens))
+
+    def test_norm(self):
+        for n in [1, 2, 3]:
+            model = KneserNeyNGram(n, self.sents)
+            contexts = [(), ('come',), ('la', 'gata'), ('<s>', 'el'),
+                        ('salame', 'come')]
+            for prev in contexts:
+                prev = prev[len(prev) - n + 1:] if n > 1 else ()
+                prob_sum = sum(model.cond_prob(token, prev)
+                               for token in self.tokens)
+                self.assertAlmostEqual(prob_sum, 1.0, msg=(n, prev))
+
+    def test_continuation_counts(self):
+        model = KneserNeyNGram(2, self.sents)
+
+        # 'pescado' is seen twice and 'carne' once, both only after 'come':
+        # the lower order counts distinct histories, so they get the same
+        # probability in a new context
+        self.assertAlmostEqual(model.cond_prob('pescado', ('salame',)),
+                               model.cond_prob('carne', ('salame',)))
+        self.assertGreater(model.cond_prob('pescado', ('come',)),
+                           model.cond_prob('carne', ('come',)))
+
+    def test_unseen_context(self):
+        model = KneserNeyNGram(3, self.sents)
+
+        # backs off all the way to the unigram distribution
+        for token in self.tokens:
+            self.assertAlmostEqual(model.cond_prob(token, ('salame', 'queso')),
+                                   model.cond_prob(token, ('queso',)))
+
+    def test_score_batch(self):
+        test_sents = [
+            'el gato come carne .'.split(),
+            'la perra come queso .'.split(),
+            [],
+        ]
+        for n in [1, 2, 3]:
+            model = KneserNeyNGram(n, self.sents)
+            scores = model.score_batch(test_sents)
+            expected = [model.sent_log_prob(sent) for sent in test_sents]
+            np.testing.assert_allclose(scores, expected)
+            self.assertTrue(np.isfinite(scores).all())
+            self.assertEqual(len(model.score_batch([])), 0)
+            self.assertEqual(model.log_prob([]), 0)
+
+    def test_trie_store(self):
+        model = KneserNeyNGram(3, self.sents)
+        trie_model = KneserNeyNGram(3, self.sents, store='trie')
+
+        for token in self.tokens:
+            self.assertAlmostEqual(trie_model.cond_prob(token, ('la', 'gata')),
+                                   model.cond_prob(token, ('la', 'gata')))
+
+    def test_generate_sent(self):
+        model = KneserNeyNGram(3, self.sents)
+        generator = NGramGenerator(model)
+
+        for i in range(20):
+            sent = generator.generate_sent()
+            self.assertTrue(set(sent) <= set(self.tokens), sent)
@@ -0,0 +1,89 @@
+# https://docs.python.org/3/library/unittest.html
+from unittest import TestCase
+import os
+import pickle
+import stat
+import tempfile
+
+from languagemodeling.model_file import save_model, load_model
+from languagemodeling.ngram import NGram, AddOneNGram, InterpolatedNGram, \
+    BackOffNGram
+
+
+class TestModelFile(TestCase):
+
+    def setUp(self):
+        self.sents = [
+            'el gato come pescado .'.split(),
+            'la gata come salmón .'.split(),
+        ]
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.tmpdir.name, 'model')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def assertSameModel(self, model, loaded):
+        self.assertEqual(type(loaded), type(model))
+        self.assertEqual(dict(loaded._count.items()), dict(model._count.items()))
+
+        tokens = ['el', 'gato', 'come', 'pescado', '.', 'salame', '</s>']
+        prevs = [('<s>', '<s>'), ('<s>', 'el'), ('el', 'come'), ('gato', 'come')]
+        for prev in prevs:
+            prev = prev[len(prev) - model._n + 1:]
+            for token in tokens:
+                self.assertEqual(loaded.cond_prob(token, prev),
+                                 model.cond_prob(token, prev))
+
+    def test_save_load(self):
+        models = [
+            NGram(3, self.sents),
+            AddOneNGram(2, self.sents),
+            InterpolatedNGram(3, self.sents, gamma=1.0),
+            BackOffNGram(3, self.sents, beta=0.5),
+            BackOffNGram(3, self.sents, beta=0.5, store='trie'),
+        ]
+        for model in models:
+            save_model(model, self.filename)
+            loaded = load_model(self.filename)
+            self.assertSameModel(model, loaded)
+
+    def test_arrays_are_mapped(self):
+        model = BackOffNGram(2, self.sents, beta=0.5)
+        save_model(model, self.filename)
+        loaded = load_model(self.filename)
+
+        keys = loaded._count._keys[2]
+        self.assertFalse(keys.flags.writeable)
+        self.assertFalse(loaded._alpha[1].flags.writeable)
+
+    def test_save_over_loaded(self):
+        model = BackOffNGram(3, self.sents, beta=0.5)
+        save_model(model, self.filename)
+
+        # the loaded arrays are mapped from the file being replaced
+        loaded = load_model(self.filename)
+        save_model(loaded, self.filename)
+        self.assertSameModel(model, load_model(self.filename))
+        self.assertSameModel(model, loaded)
+        self.assertEqual(os.listdir(self.tmpdir.name), ['model'])
+
+    def test_file_mode(self):
+        model = NGram(2, self.sents)
+        umask = os.umask(0o022)
+        try:
+            save_model(model, self.filename)
+            self.assertEqual(stat.S_IMODE(os.stat(self.filename).st_mode), 0o644)
+
+            # saving over a file keeps its mode
+            os.chmod(self.filename, 0o640)
+            save_model(model, self.filename)
+            self.assertEqual(stat.S_IMODE(os.stat(self.filename).st_mode), 0o640)
+        finally:
+            os.umask(umask)
+
+    def test_load_pickle(self):
+        model = InterpolatedNGram(2, self.sents, gamma=1.0)
+        with open(self.filename, 'wb') as f:
+            pickle.dump(model, f)
+        self.assertSameModel(model, load_model(self.filename))
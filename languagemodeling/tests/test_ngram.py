@@ -1,8 +1,9 @@
 # https://docs.python.org/3/library/unittest.html
 from unittest import TestCase
-from math import log, inf
+from math import log, inf, isnan
+import io
 
-from languagemodeling.ngram import NGram
+from languagemodeling.ngram import NGram, AddOneNGram, evaluate_models
 
 
 class TestNGram(TestCase):
@@ -59,6 +60,12 @@ class TestNGram(TestCase):
         for gram, c in counts.items():
             self.assertEqual(ngram.count(gram), c)
 
+    def test_count_iterable(self):
+        ngram = NGram(2, self.sents)
+        streamed = NGram(2, (sent for sent in self.sents))
+
+        self.assertEqual(dict(streamed._count.items()), dict(ngram._count.items()))
+
     def test_cond_prob_1gram(self):
         ngram = NGram(1, self.sents)
 
@@ -140,3 +147,83 @@ class TestNGram(TestCase):
         }
         for sent, prob in sents.items():
             self.assertAlmostEqual(ngram.sent_log_prob(sent.split()), prob, msg=sent)
+
+    def test_score_batch(self):
+        sents = [s.split() for s in [
+            'el gato come pescado .',
+            'la gata come salmón .',
+            'el gato come salame .',
+            '',
+        ]]
+        for n in range(1, 4):
+            ngram = NGram(n, self.sents)
+            scores = ngram.score_batch(sents)
+            self.assertEqual(len(scores), len(sents))
+            for sent, score in zip(sents, scores):
+                self.assertAlmostEqual(score, ngram.sent_log_prob(sent), msg=sent)
+            self.assertEqual(len(ngram.score_batch([])), 0)
+            self.assertEqual(ngram.log_prob([]), 0)
+
+    def test_evaluate(self):
+        ngram = NGram(2, self.sents)
+        sents = [s.split() for s in [
+            'el gato come pescado .',
+            'la gata come salame .',
+        ]]
+        scores_file = io.StringIO()
+        result = ngram.evaluate(iter(sents), scores_file=scores_file,
+                                batch_size=1)
+
+        self.assertEqual(result['log_prob'], -inf)
+        self.assertEqual(result['perplexity'], inf)
+        self.assertEqual(result['num_sents'], 2)
+        self.assertEqual(result['num_tokens'], 12)
+        self.assertEqual(result['oov_rate'], 0.1)
+        # 'salame' unseen, and '.' after it
+        self.assertEqual(result['zero_probs'], 2)
+        self.assertEqual(result['zero_prob_sents'], 1)
+        self.assertEqual(scores_file.getvalue(), '-2.0\t6\n-inf\t6\n')
+
+        result = ngram.evaluate(sents[:1])
+        self.assertAlmostEqual(result['cross_entropy'], 2 / 6)
+        self.assertAlmostEqual(result['perplexity'], ngram.perplexity(sents[:1]))
+
+        result = ngram.evaluate(iter([]))
+        self.assertEqual(result['log_prob'], 0)
+        self.assertTrue(isnan(result['cross_entropy']))
+        self.assertTrue(isnan(result['perplexity']))
+        self.assertEqual(result['num_sents'], 0)
+        self.assertEqual(result['oov_rate'], 0)
+
+    def test_evaluate_models(self):
+        models = [NGram(1, self.sents), NGram(2, self.sents),
+                  AddOneNGram(3, self.sents), NGram(2, self.sents[:1])]
+        sents = [s.split() for s in [
+            'el gato come pescado .',
+            'la gata come salame .',
+            'el gato come salmón .',
+        ]]
+        for workers in [1, 2]:
+            results = evaluate_models(models, iter(sents), batch_size=5,
+                                      workers=workers)
+            self.assertEqual(len(results), len(models))
+            for model, result in zip(models, results):
+                expected = model.evaluate(sents)
+                self.assertGreaterEqual(result.pop('time'), 0.0)
+                self.assertEqual(result.keys(), expected.keys())
+                for key, value in expected.items():
+                    self.assertAlmostEqual(result[key], value, msg=key)
+
+    def test_update(self):
+        new_sents = [s.split() for s in [
+            'el perro come carne .',
+            'la gata come salmón .',
+        ]]
+        for n in range(1, 4):
+            model = NGram(n, self.sents)
+            model.update(new_sents)
+            full = NGram(n, self.sents + new_sents)
+            for gram in [(), ('come',), ('el', 'perro'), ('come', 'carne', '.'),
+                         ('gata', 'come', 'salmón')]:
+                self.assertEqual(model.count(gram), full.count(gram), gram)
+            self.assertEqual(model._V, full._V)
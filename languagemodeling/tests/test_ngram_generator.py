@@ -101,3 +101,118 @@ class TestNGramGenerator(TestCase):
         for i in range(100):
             sent = generator.generate_sent()
             self.assertTrue(' '.join(sent) in sents, sent)
+
+    def test_alias_table(self):
+        sents = self.sents + [
+            'el gato come salmón .'.split(),
+            'el perro come carne .'.split(),
+            'la gata come pescado .'.split(),
+        ]
+        ngram = NGram(2, sents)
+        generator = NGramGenerator(ngram)
+
+        for prev_tokens, probs in generator._probs.items():
+            tokens, keep, alias = generator._distribution(prev_tokens)[2]
+            # probability of each token, adding up its columns and the
+            # columns where it is the alias
+            m = len(tokens)
+            table_probs = dict.fromkeys(tokens, 0.0)
+            for i, token in enumerate(tokens):
+                table_probs[token] += keep[i] / m
+                table_probs[tokens[alias[i]]] += (1.0 - keep[i]) / m
+            for token, p in probs.items():
+                self.assertAlmostEqual(table_probs[token], p, msg=token)
+
+        # built once
+        dist = generator._distribution(('come',))
+        self.assertIs(generator._distribution(('come',)), dist)
+
+    def test_lazy_distributions(self):
+        ngram = NGram(2, self.sents)
+        generator = NGramGenerator(ngram)
+        self.assertEqual(len(generator._cache), 0)
+
+        generator.generate_token(('el',))
+        self.assertEqual(list(generator._cache), [('el',)])
+        self.assertEqual(generator.generate_token(('salame',)), '')
+
+    def test_cache_size(self):
+        ngram = NGram(2, self.sents)
+        generator = NGramGenerator(ngram, cache_size=2)
+
+        sents = [
+            'el gato come pescado .',
+            'la gata come salmón .',
+            'el gato come salmón .',
+            'la gata come pescado .',
+        ]
+        for i in range(20):
+            sent = generator.generate_sent()
+            self.assertTrue(' '.join(sent) in sents, sent)
+            self.assertLessEqual(len(generator._cache), 2)
+
+    def test_generate_sents(self):
+        ngram = NGram(2, self.sents)
+        generator = NGramGenerator(ngram)
+
+        sents = [
+            'el gato come pescado .',
+            'la gata come salmón .',
+            'el gato come salmón .',
+            'la gata come pescado .',
+        ]
+        generated = list(generator.generate_sents(1000, seed=0,
+                                                  stream_size=300))
+        self.assertEqual(len(generated), 1000)
+        for sent in generated:
+            self.assertTrue(' '.join(sent) in sents, sent)
+        # every sentence has probability 1/4
+        for sent in sents:
+            count = sum(' '.join(s) == sent for s in generated)
+            self.assertTrue(150 < count < 350, (sent, count))
+
+    def test_generate_sents_1gram(self):
+        ngram = NGram(1, self.sents)
+        generator = NGramGenerator(ngram)
+
+        voc = {'el', 'gato', 'come', 'pescado', '.', 'la', 'gata', 'salmón'}
+
+        for sent in generator.generate_sents(100, seed=0):
+            self.assertTrue(set(sent).issubset(voc))
+
+    def test_generate_sents_seed(self):
+        ngram = NGram(2, self.sents)
+        generator = NGramGenerator(ngram)
+
+        # the same streams whatever the number of workers
+        sents = list(generator.generate_sents(50, seed=7, stream_size=8))
+        self.assertEqual(list(generator.generate_sents(50, seed=7,
+                                                       stream_size=8)), sents)
+        self.assertEqual(list(generator.generate_sents(50, seed=7, workers=2,
+                                                       stream_size=8)), sents)
+        self.assertNotEqual(list(generator.generate_sents(50, seed=8,
+                                                          stream_size=8)), sents)
+
+    def test_top_k(self):
+        ngram = NGram(2, self.sents)
+        generator = NGramGenerator(ngram, top_k=1)
+
+        # ties are broken by token, so 'pescado' is kept after 'come'
+        for i in range(20):
+            self.assertEqual(generator.generate_token(('come',)), 'pescado')
+            self.assertEqual(generator.generate_sent(),
+                             'el gato come pescado .'.split())
+        sents = list(generator.generate_sents(20, seed=0))
+        self.assertEqual(sents, ['el gato come pescado .'.split()] * 20)
+
+    def test_top_p(self):
+        ngram = NGram(2, self.sents)
+
+        # the first token alone adds up to 0.5
+        generator = NGramGenerator(ngram, top_p=0.5)
+        for i in range(20):
+            self.assertEqual(generator.generate_token(('come',)), 'pescado')
+
+        generator = NGramGenerator(ngram, top_p=0.6)
+        tokens = {generator.generate_token(('come',)) for i in range(100)}
+        self.assertEqual(tokens, {'pescado', 'salmón'})
@@ -1,6 +1,7 @@
+from itertools import permutations
 from unittest import TestCase
 
-from languagemodeling.ngram import SentSorter, AddOneNGram
+from languagemodeling.ngram import SentSorter, NGram, AddOneNGram
 
 
 class TestSentSorter(TestCase):
@@ -51,3 +52,77 @@ class TestSentSorter(TestCase):
             sorted_sents = ss.sort_probable_sents(unordered_sents)
             for sent in sorted_sents:
                 self.assertEqual(sent, sents[0])
+
+    def test_sort_sent_beam(self):
+        sents = [
+            'el come gato come'.split(),
+            'el gato come come'.split(),
+            'gato pescado gato gato'.split(),
+        ]
+        model = NGram(2, sents)
+        shuffled = 'come come el gato'.split()
+
+        # the greedy search is misled by the most probable first steps
+        greedy = SentSorter(model).sort_sent(shuffled)
+        beam = SentSorter(model, beam_width=3).sort_sent(shuffled)
+        best = max(permutations(shuffled),
+                   key=lambda sent: model.sent_log_prob(list(sent)))
+        self.assertLess(model.sent_log_prob(greedy), model.sent_log_prob(beam))
+        self.assertAlmostEqual(model.sent_log_prob(beam),
+                               model.sent_log_prob(list(best)))
+        self.assertEqual(sorted(beam), sorted(shuffled))
+
+    def test_sort_probable_sents_cache(self):
+        model = AddOneNGram(3, self.sents)
+        unordered_sents = [
+            'come el gato'.split(),
+            'gato come el'.split(),
+            'salta gata la'.split(),
+            [],
+        ]
+        ss = SentSorter(model, beam_width=2, cache_size=4)
+        sorted_sents = ss.sort_probable_sents(unordered_sents)
+        self.assertEqual(sorted_sents, [self.sents[0], self.sents[0],
+                                        self.sents[1], []])
+        self.assertLessEqual(len(ss._scores), 4)
+
+        # the scores are kept between sentences
+        ss = SentSorter(model, beam_width=2)
+        ss.sort_probable_sents(unordered_sents[:1])
+        num_scores = len(ss._scores)
+        ss.sort_probable_sents(unordered_sents[:1])
+        self.assertEqual(len(ss._scores), num_scores)
+
+    def test_sort_sent_exact(self):
+        sents = [
+            'el come gato come'.split(),
+            'el gato come come'.split(),
+            'gato pescado gato gato'.split(),
+        ]
+        model = NGram(2, sents)
+        ss = SentSorter(model, exact=True)
+
+        for shuffled in ['come come el gato'.split(),
+                         'gato gato pescado come el'.split(),
+                         'el'.split(),
+                         []]:
+            sent = ss.sort_sent(shuffled)
+            best = max(permutations(shuffled),
+                       key=lambda sent: model.sent_log_prob(list(sent)))
+            self.assertEqual(sorted(sent), sorted(shuffled))
+            self.assertAlmostEqual(model.sent_log_prob(sent),
+                                   model.sent_log_prob(list(best)))
+
+    def test_sort_sent_exact_max_len(self):
+        sents = [
+            'el come gato come'.split(),
+            'el gato come come'.split(),
+            'gato pescado gato gato'.split(),
+        ]
+        model = NGram(2, sents)
+        shuffled = 'come come el gato'.split()
+
+        # too long, sorted greedily
+        ss = SentSorter(model, exact=True, exact_max_len=3)
+        greedy = SentSorter(model).sort_sent(shuffled)
+        self.assertEqual(ss.sort_sent(shuffled), greedy)